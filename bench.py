@@ -0,0 +1,193 @@
+'''
+Benchmark of the pipeline (load -> backtest -> extend -> stats) on synthetic data, offline and reproducible (seeded).
+Every stage is timed (wall and CPU), with its throughput and peak memory, plus a digest of its output,
+so a change that makes a stage faster but changes what it produces shows up too.
+Results go to bench/{commit}-{timeframe}.json.
+
+    python bench.py [n_symbols] [n_bars] [1d|1h] [--no-memory]
+    python bench.py compare bench/old.json bench/new.json
+'''
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import warnings
+import numpy as np
+import pandas as pd
+from itertools import product
+
+from cache import get_panel
+from run import backtest_df, get_engine, load_df
+from stats.extender import GRID, FIXED_COLS, extend
+from stats import get_stats_df, get_stats_batch, STATS_COLUMNS, MC_RESAMPLES
+from strategies.momopump import SimplePump, SimplePumpDaily_Fibo
+
+warnings.filterwarnings('ignore')
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+STRATEGIES = {
+    '1d': (SimplePumpDaily_Fibo, {'sl_prc': [0.1, 0.3], 'reward': [1, 2], 'fibo': [0, 2], 'pullback': [0.6], 'rvol': [3], 'day_net_change': [0.2]}),
+    '1h': (SimplePump, {'sl_prc': [0.1, 0.3], 'reward': [1, 2], 'entry_hour': [15, 6], 'pullback': [0.6], 'rvol': [3], 'day_net_change': [0.2]}),
+}
+
+
+def synthetic(n_symbols: int, n_bars: int, timeframe: str = '1d', seed: int = 0, pump_rate: float = 0.03) -> list[pd.DataFrame]:
+    '''
+    Random walks with pumps: on ~pump_rate of the days the price jumps 30-100% on 3-15x the volume and mostly fades the next day,
+    so the rvol/day_net_change/pullback signals fire. 1h bars run 4:00-19:00 with the pump at 9:00-15:00.
+    Frames as run.load_df returns them.
+    '''
+    rng = np.random.default_rng(seed)
+    if timeframe == '1d':
+        index = pd.bdate_range('2020-01-01', periods=n_bars)
+    else:
+        days = pd.bdate_range('2020-01-01', periods=-(-n_bars // 16))
+        index = pd.DatetimeIndex([d + pd.Timedelta(hours=h) for d in days for h in range(4, 20)])[:n_bars]
+    per_day = 1 if timeframe == '1d' else 16
+    day = np.arange(n_bars) // per_day
+    pump_bar = index.hour.isin(range(9, 16)) if timeframe == '1h' else np.ones(n_bars, dtype=bool)
+    pump_bars = 1 if timeframe == '1d' else 7
+
+    dfs = []
+    for i in range(n_symbols):
+        pump_days = rng.random(day[-1] + 1) < pump_rate
+        jump = rng.uniform(0.3, 1.0, day[-1] + 1) * pump_days  # log return of the whole pump
+        pump = pump_days[day] & pump_bar
+        ret = rng.normal(0, 0.03 / per_day ** 0.5, n_bars)
+        ret += pump * jump[day] / pump_bars
+        ret -= 0.9 * np.r_[0, jump[:-1]][day] / per_day  # the fade, spread over the next day
+        close = 5 * np.exp(np.cumsum(ret))
+        open_ = close * np.exp(rng.normal(0, 0.01, n_bars))
+        high = np.maximum(open_, close) * (1 + rng.uniform(0, 0.05, n_bars))
+        low = np.minimum(open_, close) * (1 - rng.uniform(0, 0.05, n_bars))
+        volume = rng.integers(100_000, 200_000, n_bars).astype(np.float64)
+        volume[pump] *= rng.uniform(3, 15, pump.sum())
+        df = pd.DataFrame({
+            'Open': open_.round(3), 'High': high.round(3), 'Low': low.round(3), 'Close': close.round(3),
+            'Volume': volume.astype(np.int64),
+        }, index=pd.Index(index, name='datetime'))
+        df.attrs['symbol'] = f'S{i:04d}'
+        dfs.append(df)
+    return dfs
+
+def digest(out) -> str:
+    # of what a stage produced (frames, extend()'s {'pars', 'df'} or stats rows), rounded so that float noise doesn't count as a change
+    if isinstance(out, list) and out and isinstance(out[0], dict):
+        out = [o['df'] for o in out] if 'df' in out[0] else pd.DataFrame(out)
+    if isinstance(out, list):
+        out = pd.concat(out, ignore_index=True) if out else pd.DataFrame()
+    numeric = out.select_dtypes('number').round(6)
+    return hashlib.sha1(pd.util.hash_pandas_object(numeric, index=False).values.tobytes()).hexdigest()[:16]
+
+def stage(results: dict, name: str, func, units: dict, memory: bool = True):
+    '''
+    Runs func(), records its wall/CPU time and throughput for every unit (units - {unit: count}, or a callable of the result giving it).
+    memory - run it once more under tracemalloc for the peak memory (not timed: tracing slows pandas code down 2-3x)
+    '''
+    wall, cpu = time.perf_counter(), time.process_time()
+    out = func()
+    wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+    peak = None
+    if memory:
+        tracemalloc.start()
+        func()
+        peak = tracemalloc.get_traced_memory()[1] / 2**20
+        tracemalloc.stop()
+
+    counts = {unit: count(out) if callable(count) else count for unit, count in units.items()}
+    results[name] = {
+        'wall_s': wall, 'cpu_s': cpu, 'peak_mb': peak,
+        **counts,
+        **{f'{unit}_per_s': count / wall if wall else None for unit, count in counts.items()},
+        'digest': digest(out),
+    }
+    print(f'{name:>12}: {wall:8.3f}s', ', '.join(f'{count / wall if wall else 0:,.0f} {unit}/s' for unit, count in counts.items()), f'peak {peak:,.1f}MB' if memory else '')
+    return out
+
+def run(n_symbols: int = 50, n_bars: int = 1000, timeframe: str = '1d', seed: int = 0, memory: bool = True, max_stats: int = 200) -> dict:
+    # max_stats - get_stats_df (and the monte carlo) is scored on the first max_stats extended combinations only (it's ~20ms each), get_stats_batch on all
+    strategy, grid = STRATEGIES[timeframe]
+    combs = [dict(zip(grid.keys(), pars)) for pars in product(*grid.values())]
+    extend_combs = int(np.prod([len(v) for v in GRID.values()]))
+    results = {}
+
+    dfs = synthetic(n_symbols, n_bars, timeframe, seed)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        data_dir = tmp_dir + '/ohlcv'  # its cache goes next to it, {tmp_dir}/ohlcv.cache
+        os.makedirs(data_dir)
+        fps = [f'{data_dir}/{df.attrs["symbol"]}.csv' for df in dfs]
+        for df, fp in zip(dfs, fps):
+            df.reset_index().rename(columns=str.lower).assign(symbol=df.attrs['symbol']).to_csv(fp, index=False)
+        def load_csv():
+            shutil.rmtree(data_dir + '.cache', ignore_errors=True)  # parsed from the csv every time
+            return [load_df(fp) for fp in fps]
+        stage(results, 'load_csv', load_csv, {'symbols': n_symbols}, memory)
+        dfs = stage(results, 'load_cached', lambda: [load_df(fp).copy() for fp in fps], {'symbols': n_symbols}, memory)
+
+    raws = stage(results, 'backtest', lambda: [pd.concat([backtest_df({'df': df, 'strategy_pars': pars, 'strategy': strategy}) for df in dfs], ignore_index=True) for pars in combs],
+                 {'symbols': n_symbols * len(combs), 'trades': lambda out: sum(len(r) for r in out)}, memory)
+    backtest_grid = get_engine(strategy)
+    if backtest_grid is not None:
+        stage(results, 'engine', lambda: [trades for _, trades in backtest_grid(get_panel(dfs), strategy, combs)],
+              {'combos': len(combs), 'trades': lambda out: sum(len(r) for r in out)}, memory)
+
+    raws = [raw for raw in raws if not raw.empty]
+    edfs = stage(results, 'extend', lambda: [edf for raw in raws for edf in extend(raw.copy(), GRID, FIXED_COLS)],
+                 {'combos': len(raws) * extend_combs, 'trades': sum(len(r) for r in raws)}, memory)
+    edfs = [edf for edf in edfs if not edf['df'].empty]  # the ones with trades, like the extender scores (one day of them too, cagr NaN)
+    stage(results, 'stats', lambda: [get_stats_df(edf['df'].copy(), edf['pars']) for edf in edfs[:max_stats]], {'combos': len(edfs[:max_stats])}, memory)
+    if edfs:
+        pars = list(edfs[0]['pars'].keys())
+        batch = pd.concat([edf['df'][STATS_COLUMNS].assign(**edf['pars']) for edf in edfs], ignore_index=True)
+        stage(results, 'stats_batch', lambda: get_stats_batch(batch, pars), {'combos': len(edfs)}, memory)
+        mc = batch[batch.groupby(pars, sort=False).ngroup() < max_stats]
+        stage(results, 'monte_carlo', lambda: get_stats_batch(mc, pars, MC_RESAMPLES), {'combos': len(edfs[:max_stats]), 'resamples': len(edfs[:max_stats]) * MC_RESAMPLES}, memory)
+
+    return {
+        'commit': get_commit(),
+        'time': pd.Timestamp.now().isoformat(timespec='seconds'),
+        'config': {'n_symbols': n_symbols, 'n_bars': n_bars, 'timeframe': timeframe, 'seed': seed, 'max_stats': max_stats, 'strategy': strategy.__name__},
+        'python': sys.version.split()[0], 'numpy': np.__version__, 'pandas': pd.__version__,
+        'stages': results,
+    }
+
+def get_commit() -> str:
+    try:
+        commit = subprocess.run(['git', '-C', ROOT, 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(['git', '-C', ROOT, 'status', '--porcelain', '--untracked-files=no'], capture_output=True, text=True).stdout.strip()
+        return commit + ('-dirty' if dirty else '')
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+def compare(old: dict, new: dict):
+    if old['config'] != new['config']:
+        print('! different configs:', old['config'], new['config'])
+    print(f'{"stage":>12} {old["commit"]:>14} {new["commit"]:>14} {"speedup":>8}  output')
+    for name, o in old['stages'].items():
+        n = new['stages'].get(name)
+        if n is None: continue
+        print(f'{name:>12} {o["wall_s"]:13.3f}s {n["wall_s"]:13.3f}s {o["wall_s"] / n["wall_s"]:7.2f}x  {"same" if o["digest"] == n["digest"] else "CHANGED"}')
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == 'compare':
+        with open(sys.argv[2]) as old, open(sys.argv[3]) as new:
+            compare(json.load(old), json.load(new))
+    else:
+        # --no-memory skips the traced reruns
+        args = [a for a in sys.argv[1:] if not a.startswith('--')]
+        report = run(
+            int(args[0]) if len(args) > 0 else 50, int(args[1]) if len(args) > 1 else 1000, args[2] if len(args) > 2 else '1d',
+            memory='--no-memory' not in sys.argv,
+        )
+        os.makedirs(ROOT + '/bench', exist_ok=True)
+        path = f'{ROOT}/bench/{report["commit"]}-{report["config"]["timeframe"]}.json'
+        with open(path, 'w') as file:
+            json.dump(report, file, indent=2)
+        print('->', path)
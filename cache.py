@@ -0,0 +1,114 @@
+import numpy as np
+import pandas as pd
+import os
+import uuid
+from typing import Callable
+
+
+COLUMNS = ['Open', 'High', 'Low', 'Close', 'Volume']
+
+
+def pack(dfs: list[pd.DataFrame], dirpath: str) -> str:
+    '''
+    Packs OHLCV frames (as returned by run.load_df) into one .npy file per column,
+    concatenated symbol after symbol, plus symbols/offsets to slice them back.
+    Workers open it with mmap, so the pages are shared between processes instead of pickled to each of them.
+    '''
+    os.makedirs(dirpath, exist_ok=True)
+    dfs = [df for df in dfs if not df.empty]
+    symbols = np.array([df.attrs['symbol'] for df in dfs])
+    offsets = np.zeros(len(dfs) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([df.shape[0] for df in dfs])
+
+    np.save(dirpath + '/symbols.npy', symbols)
+    np.save(dirpath + '/offsets.npy', offsets)
+    np.save(dirpath + '/datetime.npy', np.concatenate([df.index.values.astype('datetime64[ns]') for df in dfs]))
+    for col in COLUMNS:
+        np.save(dirpath + f'/{col}.npy', np.concatenate([df[col].values.astype(np.float64) for df in dfs]))
+    return dirpath
+
+
+class Universe:
+
+    '''
+    Read-only view over a packed directory. universe[symbol] gives the same frame run.load_df would.
+    '''
+
+    def __init__(self, dirpath: str):
+        symbols = np.load(dirpath + '/symbols.npy')
+        offsets = np.load(dirpath + '/offsets.npy')
+        self.slices = {s: (offsets[i], offsets[i+1]) for i, s in enumerate(symbols)}
+        self.datetime = np.load(dirpath + '/datetime.npy', mmap_mode='r')
+        self.columns = {col: np.load(dirpath + f'/{col}.npy', mmap_mode='r') for col in COLUMNS}
+
+    def __contains__(self, symbol: str):
+        return symbol in self.slices
+
+    def __len__(self):
+        return len(self.slices)
+
+    def symbols(self) -> list[str]:
+        return list(self.slices.keys())
+
+    def __getitem__(self, symbol: str) -> pd.DataFrame:
+        start, end = self.slices[symbol]
+        df = pd.DataFrame(
+            {col: arr[start:end] for col, arr in self.columns.items()},
+            index=pd.DatetimeIndex(self.datetime[start:end], name='datetime')
+        )
+        df.attrs['symbol'] = symbol
+        return df
+
+
+def get_panel(dfs: list[pd.DataFrame]) -> pd.DataFrame:
+    '''
+    The frames stacked one after another, for the array engines (see run.get_engine). The one place a symbol is kept
+    per row, as a categorical 'symbol' column (the frames themselves only have it in df.attrs).
+    '''
+    dfs = [df for df in dfs if not df.empty]
+    panel = pd.concat(dfs)
+    panel.attrs = {}
+    codes = np.repeat(np.arange(len(dfs), dtype=np.int32), [df.shape[0] for df in dfs])
+    panel.insert(0, 'symbol', pd.Categorical.from_codes(codes, categories=[df.attrs['symbol'] for df in dfs]))
+    return panel
+
+
+def cache_path(filepath: str) -> str:
+    # data/ohlcv-1d/backtrader/AAPL.csv -> data/ohlcv-1d/backtrader.cache/AAPL.npy
+    src_dir, filename = os.path.split(os.path.abspath(filepath))
+    return src_dir + '.cache/' + os.path.splitext(filename)[0] + '.npy'
+
+def cached(filepath: str, load: Callable[[str], pd.DataFrame]) -> pd.DataFrame:
+    '''
+    load(filepath) through a binary copy of the frame: one .npy record per bar (index and columns as fields, with their dtypes),
+    read back with mmap instead of parsed. The copy gets the source's mtime and is rebuilt as soon as they differ.
+    The 'symbol' column isn't stored, it's the file name (that's how data/tobt.py names them);
+    frames where it isn't, or with other text columns, are just loaded every time.
+    Either way the frame has no 'symbol' column, just df.attrs['symbol']: the same text on every row is a lot of memory for nothing.
+    '''
+    path = cache_path(filepath)
+    symbol = os.path.splitext(os.path.basename(filepath))[0]
+    mtime = os.stat(filepath).st_mtime_ns
+    if os.path.exists(path) and os.stat(path).st_mtime_ns == mtime:
+        records = np.load(path, mmap_mode='r')
+        index, *columns = records.dtype.names
+        df = pd.DataFrame({col: records[col] for col in columns}, index=pd.Index(records[index], name=index))
+        df.attrs['symbol'] = symbol
+        return df
+
+    df = load(filepath)
+    data = df.drop(columns=['symbol'])
+    data.attrs['symbol'] = df['symbol'].iloc[0] if not df.empty else symbol
+    if (df['symbol'] != symbol).any() or any(dtype.kind not in 'biufcmM' for dtype in [df.index.dtype, *data.dtypes]):
+        return data
+    records = np.empty(df.shape[0], dtype=[(df.index.name or 'index', df.index.dtype), *data.dtypes.items()])
+    records[records.dtype.names[0]] = df.index.values
+    for col in data.columns:
+        records[col] = data[col].values
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f'{path}.{uuid.uuid4().hex}.tmp'  # written aside and renamed, so a reader never sees half a file
+    with open(tmp, 'wb') as file:
+        np.save(file, records)
+    os.utime(tmp, ns=(mtime, mtime))
+    os.replace(tmp, path)
+    return data
@@ -1,34 +1,56 @@
 from tqdm import tqdm
+from dateutil.tz import tzlocal
 import pandas as pd
+import numpy as np
 import sqlite3
 import os
 import multiprocessing as mp
-from utils import localize_ts
 
-def init_db(db_path):
-    global con
-    con = sqlite3.connect(db_path)
 
-def process_symbol(args):
-    scheme, symbol = args
-    df = pd.read_sql(f'SELECT * FROM "{scheme}" WHERE symbol = "{symbol}"', con)
-    df['timestamp'] = df['timestamp'].apply(lambda ts: localize_ts(ts, 'America/New_York').strftime('%Y-%m-%d %H:%M:%S'))
-    df.rename(columns={'timestamp': 'datetime'}).to_csv(f'data/{scheme}/backtrader/{symbol}.csv', index=False)
+def format_timestamps(ts: pd.Series) -> pd.Series:
+    # what utils.localize_ts(ts, 'America/New_York').strftime(...) gives, for a whole column at once: it labels
+    # the fromtimestamp() wall time as New York, so the text is the machine's local time
+    return pd.to_datetime(ts, unit='s', utc=True).dt.tz_convert(tzlocal()).dt.strftime('%Y-%m-%d %H:%M:%S')
+
+def write_symbol(args: tuple):
+    df, dir_path = args
+    df.rename(columns={'timestamp': 'datetime'}).to_csv(f'{dir_path}/{df["symbol"].iloc[0]}.csv', index=False)
+
+def export(con: sqlite3.Connection, scheme: str, pool: mp.Pool, chunksize: int = 1_000_000):
+    '''
+    One pass over the table in (symbol, timestamp) order: chunks are split on symbol boundaries
+    and the last symbol of a chunk is carried over, since it may continue in the next one.
+    The files of a chunk are written on the pool.
+    '''
+    con.execute(f'CREATE INDEX IF NOT EXISTS "{scheme}_symbol_timestamp" ON "{scheme}" (symbol, timestamp)')
+    total = con.execute(f'SELECT COUNT(*) FROM "{scheme}"').fetchone()[0]
+    dir_path = f'data/{scheme}/backtrader'
+    os.makedirs(dir_path, exist_ok=True)
+
+    carry = None
+    with tqdm(total=total, desc=scheme) as pbar:
+        for chunk in pd.read_sql(f'SELECT * FROM "{scheme}" ORDER BY symbol, timestamp', con, chunksize=chunksize):
+            pbar.update(chunk.shape[0])
+            chunk['timestamp'] = format_timestamps(chunk['timestamp'])
+            if carry is not None:
+                chunk = pd.concat([carry, chunk], ignore_index=True)
+            starts = np.flatnonzero(chunk['symbol'].ne(chunk['symbol'].shift()).values)
+            ends = np.r_[starts[1:], chunk.shape[0]]
+            for _ in pool.imap_unordered(write_symbol, [(chunk.iloc[start:end], dir_path) for start, end in zip(starts[:-1], ends[:-1])]):
+                pass
+            carry = chunk.iloc[starts[-1]:]
+    if carry is not None:
+        write_symbol((carry, dir_path))
 
 def main():
     db_path = 'data/data.db'
     con = sqlite3.connect(db_path)
-    cur = con.cursor()
-    
-    for scheme in ['ohlcv-1d', 'ohlcv-1h']:
-        symbols = [s[0] for s in cur.execute(f'SELECT DISTINCT symbol FROM "{scheme}"')]
-        dir_path = f'data/{scheme}/backtrader'
-        os.makedirs(dir_path, exist_ok=True)
-        
-        with mp.Pool(mp.cpu_count(), initializer=init_db, initargs=(db_path,)) as pool:
-            list(tqdm(pool.imap(process_symbol, [(scheme, symbol) for symbol in symbols]), total=len(symbols), desc=scheme))
+
+    with mp.Pool(mp.cpu_count()) as pool:
+        for scheme in ['ohlcv-1d', 'ohlcv-1h']:
+            export(con, scheme, pool)
 
     con.close()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -1,19 +1,59 @@
+import pandas as pd
 import sqlite3
-import csv
 import os
 from tqdm import tqdm
 
 
-con = sqlite3.connect('C:\\MyData\\trade\\code\\backtest\\data\\data.db')
-cur = con.cursor()
-data_scheme = 'ohlcv-1d'
+DB_PATH = 'C:\\MyData\\trade\\code\\backtest\\data\\data.db'
+# raw databento csv: ts_event (ns) is column 0, open/high/low/close/volume 4-8, symbol 9
+RAW_COLUMNS = {0: 'timestamp', 4: 'open', 5: 'high', 6: 'low', 7: 'close', 8: 'volume', 9: 'symbol'}
 
 
-for filepath in [f'{data_scheme}/raw/' + fn for fn in os.listdir(f'{data_scheme}/raw')]:
-    if not filepath.endswith('csv'): continue
-    with open(filepath, newline='') as file:
-        reader = csv.reader(file)
-        header = next(reader)
-        for row in tqdm(reader, total=reader.line_num):
-            cur.execute(f'INSERT INTO "{data_scheme}" VALUES (?, ?, ?, ?, ?, ?, ?)', (row[9], int(row[0])//1000000000, row[4], row[5], row[6], row[7], row[8]))
-        con.commit()
+def connect(db_path: str) -> sqlite3.Connection:
+    con = sqlite3.connect(db_path)
+    con.execute('PRAGMA journal_mode=WAL')
+    con.execute('PRAGMA synchronous=OFF')
+    con.execute('PRAGMA temp_store=MEMORY')
+    return con
+
+def init_tables(con: sqlite3.Connection, data_scheme: str):
+    con.execute(f'CREATE TABLE IF NOT EXISTS "{data_scheme}" (symbol TEXT, timestamp INTEGER, open REAL, high REAL, low REAL, close REAL, volume INTEGER)')
+    # raw files already loaded, so a rerun only appends the new ones
+    con.execute('CREATE TABLE IF NOT EXISTS "_loaded" (scheme TEXT, filename TEXT, PRIMARY KEY (scheme, filename))')
+
+def create_indexes(con: sqlite3.Connection, data_scheme: str):
+    # after the load: building it once is much cheaper than keeping it up to date row by row.
+    # on later appends it already exists and is just updated
+    con.execute(f'CREATE INDEX IF NOT EXISTS "{data_scheme}_symbol_timestamp" ON "{data_scheme}" (symbol, timestamp)')
+
+def count_rows(filepath: str) -> int:
+    with open(filepath, 'rb') as file:
+        return sum(buf.count(b'\n') for buf in iter(lambda: file.read(1 << 20), b'')) - 1  # header
+
+def load_file(con: sqlite3.Connection, data_scheme: str, filepath: str, pbar: tqdm, chunksize: int = 500_000):
+    # one transaction per file, together with its _loaded record, so a crash never leaves it half loaded
+    with con:
+        # keep_default_na=False, otherwise tickers like NA come back as NaN
+        for chunk in pd.read_csv(filepath, usecols=list(RAW_COLUMNS.keys()), keep_default_na=False, chunksize=chunksize):
+            chunk.columns = [RAW_COLUMNS[i] for i in sorted(RAW_COLUMNS.keys())]
+            chunk['timestamp'] = chunk['timestamp'] // 1000000000
+            rows = chunk[['symbol', 'timestamp', 'open', 'high', 'low', 'close', 'volume']].itertuples(index=False, name=None)
+            con.executemany(f'INSERT INTO "{data_scheme}" VALUES (?, ?, ?, ?, ?, ?, ?)', rows)
+            pbar.update(chunk.shape[0])
+        con.execute('INSERT INTO "_loaded" VALUES (?, ?)', (data_scheme, os.path.basename(filepath)))
+
+def main(data_scheme: str):
+    con = connect(DB_PATH)
+    init_tables(con, data_scheme)
+    loaded = {r[0] for r in con.execute('SELECT filename FROM "_loaded" WHERE scheme = ?', (data_scheme,))}
+    filepaths = [f'{data_scheme}/raw/' + fn for fn in sorted(os.listdir(f'{data_scheme}/raw')) if fn.endswith('csv') and fn not in loaded]
+
+    with tqdm(total=sum(count_rows(fp) for fp in filepaths), desc=data_scheme) as pbar:
+        for filepath in filepaths:
+            load_file(con, data_scheme, filepath, pbar)
+    create_indexes(con, data_scheme)
+    con.close()
+
+
+if __name__ == '__main__':
+    main('ohlcv-1d')
@@ -0,0 +1,77 @@
+import numpy as np
+import pandas as pd
+import hashlib
+import inspect
+import json
+import os
+import sys
+import uuid
+from backtesting import Strategy
+
+
+def strategy_version(strategy: Strategy) -> str:
+    # the whole module, since the strategies share helpers and constants (precomputed, FIBO, ...)
+    return hashlib.sha1(inspect.getsource(sys.modules[strategy.__module__]).encode()).hexdigest()[:16]
+
+def data_version(df: pd.DataFrame) -> str:
+    h = hashlib.sha1(df.index.values.astype('datetime64[ns]').tobytes())
+    for col in ['Open', 'High', 'Low', 'Close', 'Volume']:
+        h.update(np.ascontiguousarray(df[col].values, dtype=np.float64).tobytes())
+    return h.hexdigest()[:16]
+
+
+class Manifest:
+
+    '''
+    What a run's output already holds: for every (strategy, strategy version, pars) unit, keyed by their hash,
+    the symbols whose trades are in it and the version of the data they were backtested on.
+    run.run_grid only runs the cells it doesn't have, so a crashed or extended grid picks up where it stopped,
+    and new symbols/bars only re-run the symbols that changed.
+    '''
+
+    def __init__(self, path: str, strategy: Strategy):
+        self.path = path
+        self.strategy = strategy.__name__
+        self.version = strategy_version(strategy)
+        self.units = {}
+        if os.path.exists(path):
+            with open(path) as file:
+                self.units = json.load(file)
+
+    def key(self, pars: dict) -> str:
+        unit = json.dumps([self.strategy, self.version, {k: float(v) for k, v in pars.items()}], sort_keys=True)
+        return hashlib.sha1(unit.encode()).hexdigest()
+
+    def has(self, pars: dict) -> bool:
+        return self.key(pars) in self.units
+
+    def todo(self, pars: dict, versions: dict[str, str]) -> tuple[list[str], list[str]]:
+        '''
+        versions - {symbol: data_version} of the current data
+        returns the symbols to backtest and the ones whose trades in the output are stale (changed or gone)
+        '''
+        done = self.units.get(self.key(pars), {}).get('symbols', {})
+        return [s for s, v in versions.items() if done.get(s) != v], [s for s, v in done.items() if versions.get(s) != v]
+
+    def record(self, pars: dict, versions: dict[str, str]):
+        key = self.key(pars)
+        if key not in self.units:
+            # the same pars under an older strategy version are replaced, not kept alongside
+            self.units = {k: u for k, u in self.units.items() if not (u['strategy'] == self.strategy and u['pars'] == pars)}
+            self.units[key] = {'strategy': self.strategy, 'version': self.version, 'pars': pars, 'symbols': {}}
+        self.units[key]['symbols'].update(versions)
+
+    def forget(self, pars: dict, symbols: list[str] = None):
+        key = self.key(pars)
+        if symbols is None:
+            self.units.pop(key, None)
+        elif key in self.units:
+            for s in symbols:
+                self.units[key]['symbols'].pop(s, None)
+
+    def save(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        tmp = f'{self.path}.{uuid.uuid4().hex}.tmp'
+        with open(tmp, 'w') as file:
+            json.dump(self.units, file)
+        os.replace(tmp, self.path)
@@ -0,0 +1,140 @@
+"""
+Portfolio backtest: the whole universe against one account, instead of an isolated Backtest(cash=10000) per symbol.
+
+The strategy's trades are generated in one pass over the panel (the array engine, see run.get_engine, or run.backtest_df
+per symbol for the strategies without one), then walked in time order across all the symbols at once: exits give the
+cash back first, the entries of the same bar compete for what's left, best `rank` first, and an entry is skipped
+if the account can't pay for it or already holds `max_positions`. The equity curve marks the open positions to the
+close of every bar of the date-aligned panel.
+
+What it doesn't model: a skipped entry doesn't give the symbol another trade later (the per-symbol signals assume
+it was taken), which only matters for strategies that wait for a flat position, like SimplePump.
+"""
+import heapq
+import numpy as np
+import pandas as pd
+import multiprocessing as mp
+from backtesting import Strategy
+from tqdm.contrib.concurrent import process_map
+
+from cache import get_panel
+from run import backtest_df, get_engine
+from utils import compact
+
+
+TAKEN, NO_CASH, NO_SLOT = 0, 1, 2
+
+
+def get_signals(dfs: list[pd.DataFrame], strategy: Strategy, pars: dict) -> pd.DataFrame:
+    # every trade the strategy would take with unlimited capital
+    backtest_grid = get_engine(strategy)
+    if backtest_grid is not None:
+        return next(backtest_grid(get_panel(dfs), strategy, [pars]))[1]
+    trades = process_map(backtest_df, [{'df': df, 'strategy_pars': pars, 'strategy': strategy} for df in dfs], max_workers=mp.cpu_count(), chunksize=16, desc='Signals')
+    return compact(pd.concat(trades, ignore_index=True))
+
+def select(trades: pd.DataFrame, cash: float, max_positions: int, rank: str = None) -> np.ndarray:
+    '''
+    returns the fate of every trade: TAKEN, NO_CASH or NO_SLOT
+    rank - column to prefer the entries of the same bar by (descending), e.g. 'rvol'; trade order otherwise
+    '''
+    entry = trades['EntryTime'].values.astype('datetime64[ns]').astype(np.int64)
+    exit_ = trades['ExitTime'].values.astype('datetime64[ns]').astype(np.int64)
+    cost = (trades['Size'] * trades['EntryPrice']).values
+    proceeds = (trades['Size'] * trades['ExitPrice']).values
+    keys = [np.arange(len(trades))] + ([-trades[rank].values] if rank else []) + [entry]
+    order = np.lexsort(keys)
+
+    status = np.full(len(trades), NO_SLOT, dtype=np.int8)
+    exits = []  # (exit time, trade) of the open positions
+    for i in order:
+        while exits and exits[0][0] <= entry[i]:
+            cash += proceeds[heapq.heappop(exits)[1]]
+        if len(exits) >= max_positions:
+            continue
+        if cost[i] > cash:
+            status[i] = NO_CASH
+            continue
+        cash -= cost[i]
+        status[i] = TAKEN
+        heapq.heappush(exits, (exit_[i], i))
+    return status
+
+def get_equity(dfs: list[pd.DataFrame], trades: pd.DataFrame, cash: float) -> pd.DataFrame:
+    '''
+    Cash, Value (open positions at the close), Equity, Positions and UsedBP (their cost) on every bar of the panel
+    '''
+    time = np.unique(np.concatenate([df.index.values for df in dfs]))
+    n = len(time)
+    entry = np.searchsorted(time, trades['EntryTime'].values)
+    exit_ = np.searchsorted(time, trades['ExitTime'].values)
+    cost = (trades['Size'] * trades['EntryPrice']).values
+    proceeds = (trades['Size'] * trades['ExitPrice']).values
+
+    def steps(at_entry, at_exit):
+        d = np.zeros(n + 1)
+        np.add.at(d, entry, at_entry)
+        np.add.at(d, exit_, at_exit)
+        return np.cumsum(d[:-1])
+
+    # a symbol's holdings, marked at its close, hold until its next bar: added to the panel as changes
+    value = np.zeros(n + 1)
+    by_symbol = {s: g for s, g in trades.groupby('Symbol', sort=False)}
+    for df in dfs:
+        g = by_symbol.get(df.attrs['symbol'])
+        if g is None: continue
+        held = np.zeros(df.shape[0] + 1)
+        np.add.at(held, g['EntryBar'].values, g['Size'].values)
+        np.add.at(held, g['ExitBar'].values, -g['Size'].values)
+        v = np.cumsum(held[:-1]) * df['Close'].values
+        np.add.at(value, np.searchsorted(time, df.index.values), np.diff(v, prepend=0))
+
+    equity = pd.DataFrame({
+        'Cash': cash + steps(-cost, proceeds),
+        'Value': np.cumsum(value[:-1]),
+        'Positions': steps(1, -1).astype(np.int64),
+        'UsedBP': steps(cost, -cost),
+    }, index=pd.Index(time, name='datetime'))
+    equity.insert(2, 'Equity', equity['Cash'] + equity['Value'])
+    return equity
+
+def get_summary(status: np.ndarray, equity: pd.DataFrame, cash: float) -> dict:
+    ec = equity['Equity']
+    return {
+        'signals': len(status),
+        'taken': int((status == TAKEN).sum()),
+        'no_cash': int((status == NO_CASH).sum()),
+        'no_slot': int((status == NO_SLOT).sum()),
+        'max_positions': int(equity['Positions'].max()) if len(equity) else 0,
+        'max_used_bp': float(equity['UsedBP'].max()) if len(equity) else 0.0,
+        'final_equity': float(ec.iloc[-1]) if len(ec) else cash,
+        'max_drawdown': float((ec.cummax() - ec).max()) if len(ec) else 0.0,
+    }
+
+def backtest_portfolio(dfs: list[pd.DataFrame], strategy: Strategy, pars: dict, cash: float = 100000, max_positions: int = 20, rank: str = None) -> tuple[pd.DataFrame, pd.DataFrame, dict]:
+    '''
+    returns the trades taken, the equity curve and a summary (how many signals the account could take, peak usage, ...)
+    '''
+    dfs = [df for df in dfs if not df.empty]
+    signals = get_signals(dfs, strategy, pars)
+    status = select(signals, cash, max_positions, rank)
+    trades = signals[status == TAKEN].reset_index(drop=True)
+    equity = get_equity(dfs, trades, cash)
+    return trades, equity, get_summary(status, equity, cash)
+
+
+if __name__ == '__main__':
+    import os
+    from run import load_df
+    from strategies.momopump import SimplePumpDaily_Fibo
+
+    name, strategy = 'simplepump-fibo-1', SimplePumpDaily_Fibo
+    data_dir = 'data/ohlcv-1d/backtrader'
+    dfs = process_map(load_df, [data_dir + '/' + fn for fn in os.listdir(data_dir)], max_workers=mp.cpu_count(), chunksize=16, desc='Data')
+    trades, equity, summary = backtest_portfolio(dfs, strategy, {'sl_prc': 0.3, 'reward': 2, 'fibo': 0}, cash=100000, max_positions=20, rank='rvol')
+
+    out_dir = f'data/portfolio-{name}'
+    os.makedirs(out_dir, exist_ok=True)
+    trades.to_csv(f'{out_dir}/trades.csv', index=False)
+    equity.to_csv(f'{out_dir}/equity.csv')
+    print(summary)
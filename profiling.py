@@ -0,0 +1,170 @@
+"""
+Opt-in instrumentation of a run. Off unless BACKTEST_PROFILE=1 is set (or enable() is called before the run),
+and then every @timed stage (load_df, backtest_df, extend, get_stats, ...) and every symbol a worker backtests
+(@per_symbol: wall/CPU time, bytes pickled to and from the worker) is appended as a json line to
+{session dir}/events-{pid}.jsonl, so the workers of a pool don't need to send anything back.
+At the end of the run report() sums them into report.json, and with BACKTEST_PROFILE_TOP=N the N slowest symbols are
+backtested once more under cProfile into {symbol}.prof (pstats format: snakeviz, flameprof, gprof2dot, ...).
+"""
+import cProfile
+import functools
+import json
+import os
+import pickle
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+
+ENABLED = os.getenv('BACKTEST_PROFILE', '') not in ('', '0')
+TOP = int(os.getenv('BACKTEST_PROFILE_TOP', '0'))  # cProfile the TOP slowest symbols
+ROOT_DIR = 'profile'  # sessions go to {ROOT_DIR}/{name}-{time}
+
+_events = None  # this process' events file
+
+
+def enable(top: int = 0):
+    # same as the env vars; they're also what the workers started afterwards see
+    global ENABLED, TOP
+    ENABLED, TOP = True, top
+    os.environ['BACKTEST_PROFILE'] = '1'
+    os.environ['BACKTEST_PROFILE_TOP'] = str(top)
+
+def session_dir() -> str:
+    return os.getenv('BACKTEST_PROFILE_DIR', ROOT_DIR + '/default')
+
+def record(event: dict):
+    global _events
+    if _events is None or _events.name != f'{session_dir()}/events-{os.getpid()}.jsonl':
+        os.makedirs(session_dir(), exist_ok=True)
+        _events = open(f'{session_dir()}/events-{os.getpid()}.jsonl', 'a', buffering=1)  # line buffered: a killed worker loses nothing
+    _events.write(json.dumps(event) + '\n')
+
+@contextmanager
+def stage(name: str):
+    if not ENABLED:
+        yield
+        return
+    wall, cpu = time.perf_counter(), time.process_time()
+    try:
+        yield
+    finally:
+        record({'stage': name, 'wall': time.perf_counter() - wall, 'cpu': time.process_time() - cpu})
+
+def timed(name: str = None):
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not ENABLED:
+                return func(*args, **kwargs)
+            with stage(name or func.__name__):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def per_symbol(func):
+    '''
+    For the pool tasks that take (symbol, ...) and return what goes back to the main process:
+    their time, and the pickled size of the task and of the result (what the pool sends through its pipes)
+    '''
+    @functools.wraps(func)
+    def wrapper(args: tuple):
+        if not ENABLED:
+            return func(args)
+        wall, cpu = time.perf_counter(), time.process_time()
+        out = func(args)
+        wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+        record({
+            'stage': func.__name__, 'symbol': args[0], 'wall': wall, 'cpu': cpu,
+            'in_bytes': len(pickle.dumps(args)), 'out_bytes': len(pickle.dumps(out)),
+        })
+        return out
+    return wrapper
+
+@contextmanager
+def session(name: str, label: str = None):
+    '''
+    For the entry points (run_1d/run_1h, the extender and stats.py scripts): a session dir per run (named `name`),
+    the run timed as a stage (`label`, name by default), and report() at the end
+    '''
+    if not ENABLED:
+        yield
+        return
+    os.environ['BACKTEST_PROFILE_DIR'] = f'{ROOT_DIR}/{name}-{time.strftime("%Y%m%d-%H%M%S")}'
+    try:
+        with stage(label or name):
+            yield
+    finally:
+        report()
+
+def entry(func):
+    # session() around every call of func, named after it and its string args (run_1d('simplepump-fibo-1', ...) -> run_1d-simplepump-fibo-1)
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with session('-'.join([func.__name__] + [a for a in args if isinstance(a, str)]), func.__name__):
+            return func(*args, **kwargs)
+    return wrapper
+
+def read_events() -> list[dict]:
+    events = []
+    if not os.path.exists(session_dir()): return events
+    for fn in os.listdir(session_dir()):
+        if fn.startswith('events-'):
+            with open(f'{session_dir()}/{fn}') as file:
+                events.extend(json.loads(line) for line in file if line.strip())
+    return events
+
+def slowest(n: int) -> list[str]:
+    # symbols by their total backtest time (a symbol is one task in 'symbol' mode, one per combination otherwise)
+    wall = defaultdict(float)
+    for e in read_events():
+        if 'symbol' in e:
+            wall[e['symbol']] += e['wall']
+    return sorted(wall, key=wall.get, reverse=True)[:n]
+
+def profile_slowest(func, n: int = None):
+    '''
+    Backtests the n (TOP) slowest symbols of the session again, func(symbol), under cProfile
+    '''
+    if not ENABLED: return
+    for symbol in slowest(TOP if n is None else n):
+        profiler = cProfile.Profile()
+        profiler.runcall(func, symbol)
+        profiler.dump_stats(f'{session_dir()}/{symbol}.prof')
+
+def report(top: int = 20) -> dict:
+    events = read_events()
+    stages = defaultdict(lambda: {'calls': 0, 'wall': 0.0, 'cpu': 0.0, 'max_wall': 0.0})
+    symbols = defaultdict(lambda: {'tasks': 0, 'wall': 0.0, 'cpu': 0.0, 'in_bytes': 0, 'out_bytes': 0})
+    for e in events:
+        s = stages[e['stage']]
+        s['calls'] += 1
+        s['wall'] += e['wall']
+        s['cpu'] += e['cpu']
+        s['max_wall'] = max(s['max_wall'], e['wall'])
+        if 'symbol' in e:
+            sym = symbols[e['symbol']]
+            sym['tasks'] += 1
+            for k in ('wall', 'cpu', 'in_bytes', 'out_bytes'):
+                sym[k] += e[k]
+
+    summary = {
+        'stages': dict(sorted(stages.items(), key=lambda kv: -kv[1]['wall'])),  # summed over the processes
+        'symbols': len(symbols),
+        'ipc_in_bytes': sum(s['in_bytes'] for s in symbols.values()),
+        'ipc_out_bytes': sum(s['out_bytes'] for s in symbols.values()),
+        'slowest': dict(sorted(symbols.items(), key=lambda kv: -kv[1]['wall'])[:top]),
+        'profiles': sorted(fn for fn in os.listdir(session_dir()) if fn.endswith('.prof')) if os.path.exists(session_dir()) else [],
+    }
+    os.makedirs(session_dir(), exist_ok=True)
+    with open(f'{session_dir()}/report.json', 'w') as file:
+        json.dump(summary, file, indent=2)
+
+    print(f'{"stage":>24} {"calls":>8} {"wall s":>10} {"cpu s":>10} {"max s":>8}')
+    for name, s in summary['stages'].items():
+        print(f'{name:>24} {s["calls"]:>8} {s["wall"]:>10.2f} {s["cpu"]:>10.2f} {s["max_wall"]:>8.2f}')
+    print(f'{summary["symbols"]} symbols, {summary["ipc_in_bytes"] / 2**20:,.1f}MB to the workers, {summary["ipc_out_bytes"] / 2**20:,.1f}MB back')
+    for symbol, s in list(summary['slowest'].items())[:5]:
+        print(f'{symbol:>24} {s["tasks"]:>8} {s["wall"]:>10.2f} {s["cpu"]:>10.2f}')
+    print('->', session_dir() + '/report.json')
+    return summary
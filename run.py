@@ -3,23 +3,170 @@ import os
 import warnings
 import multiprocessing as mp
 import sqlite3
+import tempfile
 from itertools import product
 from tqdm import tqdm
 from tqdm.contrib.concurrent import process_map
 from backtesting import Backtest, Strategy
+from cache import pack, get_panel, Universe, cached
+from utils import TRADE_COLUMNS, compact
+from trades import TradeWriter, TradeStore
+from manifest import Manifest, data_version
+import profiling
 
 warnings.filterwarnings('ignore')
 
 
+def get_trades(stats: pd.Series, symbol: str, strategy: Strategy) -> pd.DataFrame:
+    # the tag dicts become typed columns (strategy.schema()) here, once, so nothing downstream parses strings
+    trades = stats._trades
+    trades.insert(0, 'Symbol', symbol)
+    schema = strategy.schema()
+    tags = pd.DataFrame(trades['Tag'].to_list(), columns=list(schema.keys()), index=trades.index).astype(schema)
+    return compact(pd.concat([trades[TRADE_COLUMNS].astype({'SL': 'float64', 'TP': 'float64'}), tags], axis=1))
+
+def get_trade_columns(strategy: Strategy) -> list[str]:
+    return TRADE_COLUMNS + list(strategy.schema().keys())
+
+@profiling.timed()
 def backtest_df(args: dict):
     def func(df: pd.DataFrame, strategy_pars: dict, strategy: Strategy):
         backtest = Backtest(df, strategy, cash=10000, trade_on_close=True)  # trade_on_close !!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!
         stats = backtest.run(**strategy_pars)
-        stats._trades.insert(0, 'Symbol', df['symbol'].iloc[0])
-        return stats._trades[['Symbol', 'Size', 'EntryBar', 'ExitBar', 'EntryPrice', 'ExitPrice', 'SL', 'TP', 'PnL', 'ReturnPct', 'EntryTime', 'ExitTime', 'Duration', 'Tag']]
+        return get_trades(stats, df.attrs['symbol'], strategy)
     return func(args['df'], args['strategy_pars'], args['strategy'])
 
+def init_worker(cache_dir: str, strategy: Strategy):
+    # every worker opens the packed universe once (mmap, so the pages are shared), tasks only carry the symbol and pars
+    global universe, worker_strategy
+    universe = Universe(cache_dir)
+    worker_strategy = strategy
+
+@profiling.per_symbol
+def backtest_symbol(args: tuple[str, dict]):
+    symbol, strategy_pars = args
+    return backtest_df({'df': universe[symbol], 'strategy_pars': strategy_pars, 'strategy': worker_strategy})
+
+@profiling.per_symbol
+def backtest_symbol_grid(args: tuple[str, list[dict]]):
+    # one symbol against the whole grid: a single Backtest, and indicators that don't depend on the swept pars
+    # (strategy.precompute) are added as columns once instead of being recomputed in every init()
+    symbol, combs = args
+    df = universe[symbol]
+    if hasattr(worker_strategy, 'precompute'):
+        for col, values in worker_strategy.precompute(df).items():
+            df[col] = values
+    backtest = Backtest(df, worker_strategy, cash=10000, trade_on_close=True)
+    return symbol, [get_trades(backtest.run(**pars), symbol, worker_strategy) for pars in combs]
+
+def get_engine(strategy: Strategy):
+    # the array engine's backtest_grid(panel, strategy, combs) for the strategies that have one, else None
+    from strategies.momopump import SimplePump
+    from strategies.vectorized import DAILY
+    if strategy is SimplePump:
+        from strategies.hourly import backtest_grid
+        return backtest_grid
+    if strategy in DAILY:
+        from strategies.vectorized import backtest_grid
+        return backtest_grid
+    return None
+
+def get_sink(out_dir: str, combs: list[dict], store: str, strategy: Strategy):
+    # store='csv' - a trades-{pars}.csv per combination in out_dir, 'parquet' - one TradeStore in {out_dir}.parquet,
+    # partitioned by the swept pars (the fixed ones are just columns)
+    if store == 'parquet':
+        swept = [k for k in combs[0].keys() if len(set(c[k] for c in combs)) > 1]
+        return TradeStore(out_dir + '.parquet', partitioning=swept)
+    return TradeWriter(out_dir, get_trade_columns(strategy))
+
+def get_todo(manifest: Manifest, writer, combs: list[dict], versions: dict[str, str], resume: bool) -> list[set[str]]:
+    # symbols left to backtest per combination; whatever of the output can't be kept is dropped right away
+    todo = []
+    for pars in combs:
+        if resume and manifest.has(pars):
+            symbols, stale = manifest.todo(pars, versions)
+            if symbols or stale:
+                # the ones to redo too: a crashed run may have left some of their trades behind (flushed, never recorded)
+                writer.drop(pars, symbols + stale)
+                manifest.forget(pars, stale)
+        else:
+            # never run, or with another version of the strategy
+            symbols = list(versions.keys())
+            writer.drop(pars)
+            manifest.forget(pars)
+        todo.append(set(symbols))
+    manifest.save()
+    return todo
+
+def run_grid(dfs: list[pd.DataFrame], strategy: Strategy, combs: list[dict], out_dir: str, mode: str = 'symbol', store: str = 'csv', resume: bool = True, checkpoint: int = 500):
+    # mode='symbol' - one task per symbol runs every combination, 'combination' - one pass over the symbols per combination,
+    # 'vectorized' - the array engine (get_engine) over the whole universe stacked into one panel:
+    # strategies.vectorized for SimplePumpDaily_*, strategies.hourly for SimplePump
+    # resume - only the (combination, symbol) cells missing from the run's manifest (see manifest.py) are backtested,
+    # resume=False starts every combination over. In 'symbol' mode the output is made durable every `checkpoint` symbols
+    dfs = [df for df in dfs if not df.empty]
+    versions = {df.attrs['symbol']: data_version(df) for df in dfs}
+    manifest = Manifest(out_dir + ('.parquet/_manifest.json' if store == 'parquet' else '.manifest.json'), strategy)
+
+    with get_sink(out_dir, combs, store, strategy) as writer:
+        todo = get_todo(manifest, writer, combs, versions, resume)
+        left = [i for i in range(len(combs)) if todo[i]]
+        symbols = set().union(*todo)
+        dfs = [df for df in dfs if df.attrs['symbol'] in symbols]
+        print(f'{len(left)}/{len(combs)} combinations, {len(symbols)}/{len(versions)} symbols to backtest')
+        if not left: return
+
+        if mode == 'vectorized':
+            backtest_grid = get_engine(strategy)
+            panel = get_panel(dfs)
+            del dfs
+            for i, (pars, trades) in zip(left, tqdm(backtest_grid(panel, strategy, [combs[i] for i in left]), total=len(left), desc='Grid')):
+                writer.write(pars, trades[trades['Symbol'].isin(todo[i])])
+                writer.finish(pars)
+                manifest.record(pars, {s: versions[s] for s in todo[i]})
+                manifest.save()
+            return
+
+        with tempfile.TemporaryDirectory() as cache_dir:
+            pack(dfs, cache_dir)
+            del dfs
+            with mp.Pool(mp.cpu_count(), initializer=init_worker, initargs=(cache_dir, strategy)) as pool:
+                if mode == 'symbol':
+                    # trades are appended per combination as each symbol comes back, whatever order they finish in
+                    tasks = {symbol: [i for i in left if symbol in todo[i]] for symbol in symbols}
+                    done, n = [], 0
+                    for symbol, trades in tqdm(pool.imap_unordered(backtest_symbol_grid, [(symbol, [combs[i] for i in idx]) for symbol, idx in tasks.items()]), total=len(tasks), desc='Backtesting'):
+                        for i, df in zip(tasks[symbol], trades):
+                            writer.write(combs[i], df)
+                        done.append(symbol)
+                        n += 1
+                        if len(done) == checkpoint or n == len(tasks):
+                            writer.checkpoint()
+                            for s in done:
+                                for i in tasks[s]:
+                                    manifest.record(combs[i], {s: versions[s]})
+                            manifest.save()
+                            done = []
+                else:
+                    for i in tqdm(left, desc='Grid'):
+                        pars = combs[i]
+                        for df in tqdm(pool.imap_unordered(backtest_symbol, [(symbol, pars) for symbol in todo[i]], chunksize=16), total=len(todo[i]), desc='Backtesting', leave=False):
+                            writer.write(pars, df)
+                        writer.finish(pars)
+                        manifest.record(pars, {s: versions[s] for s in todo[i]})
+                        manifest.save()
+
+            if profiling.ENABLED and profiling.TOP:
+                # the slowest symbols once more, here, under cProfile (see profiling.py)
+                init_worker(cache_dir, strategy)
+                profiling.profile_slowest(lambda symbol: backtest_symbol_grid.__wrapped__((symbol, [combs[i] for i in left if symbol in todo[i]])))
+
+@profiling.timed()
 def load_df(filepath: str) -> pd.DataFrame:
+    # parsed once, then read from the binary copy in {data_dir}.cache until the csv changes (see cache.cached)
+    return cached(filepath, read_csv_df)
+
+def read_csv_df(filepath: str) -> pd.DataFrame:
     df = pd.read_csv(filepath)
     df['datetime'] = pd.to_datetime(df['datetime'])
     df.set_index('datetime', inplace=True)
@@ -31,19 +178,24 @@ def run_single(symbol: str, strategy: Strategy, timeframe: str):
     df = load_df(data_dir + f'/{symbol}.csv')
     backtest = Backtest(df, strategy, cash=10000, trade_on_close=True)
     stats = backtest.run()
-    stats._trades.insert(0, 'Symbol', df['symbol'].iloc[0])
+    stats._trades.insert(0, 'Symbol', df.attrs['symbol'])
     stats._trades.to_csv('trades.csv', index=False)
     return stats
 
-def run_1h(name):
+def load_candidates(filepaths: list[str], strategy: Strategy, grid: dict, window: tuple[int, int] = None) -> list[pd.DataFrame]:
+    # only the symbols that fire at the loosest pars of the grid (see screen.py), trimmed to window=(bars before, bars after) their triggers
+    from screen import screen, trim
+    candidates = screen(filepaths, strategy, grid)
+    dfs = process_map(load_df, list(candidates.keys()), max_workers=mp.cpu_count(), desc='Data')
+    if window is not None:
+        dfs = [trim(df, candidates[fp], *window) for fp, df in zip(candidates.keys(), dfs)]
+    return dfs
+
+@profiling.entry
+def run_1h(name, strategy, mode='symbol', store='csv', window=None):
+    # window - e.g. (16*30, 16*7): keep only the bars around the triggers, 30 days of warmup before, 7 days after
+    if not os.path.exists(f'data/trades-{name}/raw'): os.makedirs(f'data/trades-{name}/raw')
     data_dir = 'data/ohlcv-1h/backtrader'
-    symbols = (pd.read_csv('trades/sample.csv')['Symbol'] + '.csv').unique()  # initial backtest with the most loose pars to cut the amount of symbols to test
-    dfs = process_map(
-        load_df,
-        [data_dir + '/' + symbol_fn for symbol_fn in os.listdir(data_dir) if symbol_fn in symbols],
-        max_workers=mp.cpu_count(),
-        desc='Data'
-    )
 
     grid = {
         'sl_prc': [0.1, 0.2, 0.3, 0.4, 0.5],
@@ -55,28 +207,16 @@ def run_1h(name):
     }
     keys = grid.keys()
     combs = [dict(zip(keys, pars)) for pars in product(*grid.values())]
-    for pars in tqdm(combs, desc='Grid'):
-        res = process_map(backtest_df, [{'df': df, 'strategy_pars': pars} for df in dfs], max_workers=mp.cpu_count(), desc='Backtesting')
-        
-        stats = pd.DataFrame(columns=res[0].columns)
-        for df in res:
-            stats = pd.concat([stats, df], ignore_index=True)
-        stats.to_csv(
-            'trades/trades-' + '-'.join([k + '=' + str(v) for k, v in pars.items()]) + '.csv',
-            index=False
-        )
-
-def run_1d(name, strategy):
+    dfs = load_candidates([data_dir + '/' + symbol_fn for symbol_fn in os.listdir(data_dir)], strategy, grid, window)
+    run_grid(dfs, strategy, combs, f'data/trades-{name}/raw', mode, store)
+
+@profiling.entry
+def run_1d(name, strategy, mode='symbol', store='csv', window=None):
+    # window - e.g. (30, 5) bars before/after the triggers, see run_1h
     if not os.path.exists(f'data/trades-{name}/raw'): os.makedirs(f'data/trades-{name}/raw')
     data_dir = 'data/ohlcv-1d/backtrader'
     conn = sqlite3.connect('data/data.db')
     symbols = (pd.read_sql('SELECT DISTINCT symbol FROM "ohlcv-1d"', conn)['symbol'] + '.csv').values
-    dfs = process_map(
-        load_df,
-        [data_dir + '/' + symbol_fn for symbol_fn in os.listdir(data_dir) if symbol_fn in symbols],
-        max_workers=mp.cpu_count(),
-        desc='Data'
-    )
 
     grid = {
         'sl_prc': [0.1, 0.2, 0.3, 0.4, 0.5],
@@ -88,16 +228,8 @@ def run_1d(name, strategy):
     }
     keys = grid.keys()
     combs = [dict(zip(keys, pars)) for pars in product(*grid.values())]
-    for pars in tqdm(combs, desc='Grid'):
-        res = process_map(backtest_df, [{'df': df, 'strategy_pars': pars, 'strategy': strategy} for df in dfs], max_workers=mp.cpu_count(), desc='Backtesting')
-        
-        stats = pd.DataFrame(columns=res[0].columns)
-        for df in res:
-            stats = pd.concat([stats, df], ignore_index=True)
-        stats.to_csv(
-            f'data/trades-{name}/raw/trades-' + '-'.join([k + '=' + str(v) for k, v in pars.items()]) + '.csv',
-            index=False
-        )
+    dfs = load_candidates([data_dir + '/' + symbol_fn for symbol_fn in os.listdir(data_dir) if symbol_fn in symbols], strategy, grid, window)
+    run_grid(dfs, strategy, combs, f'data/trades-{name}/raw', mode, store)
 
 if __name__ == '__main__':
     # run_single('RGTI')
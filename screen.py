@@ -0,0 +1,58 @@
+"""
+Cheap first pass over the universe before the grid: every symbol is scanned for the entry condition
+(rvol / day_net_change / pullback) at the loosest values of the grid, with the array engine's features (see run.get_engine).
+A symbol that never fires there has no trades in any combination, so it's left out of the backtest.
+
+Optionally the symbols are also trimmed to the span around their triggers (trim): enough bars before the first one
+for the indicators to warm up the same way, and after the last one for the trade to finish.
+Bars (EntryBar/ExitBar) are then counted from the start of the span.
+"""
+import numpy as np
+import pandas as pd
+import multiprocessing as mp
+from backtesting import Strategy
+from tqdm.contrib.concurrent import process_map
+
+from run import load_df
+
+
+# the direction each threshold loosens in
+LOOSE = {'rvol': min, 'day_net_change': min, 'pullback': max}
+
+
+def loosest(grid: dict) -> dict:
+    return {k: f(grid[k]) for k, f in LOOSE.items() if k in grid}
+
+def get_triggers(df: pd.DataFrame, strategy: Strategy, pars: dict) -> np.ndarray:
+    # bars where the entry condition holds, None if the strategy has no features to scan (keep the symbol)
+    from strategies.momopump import SimplePump
+    from strategies.vectorized import DAILY
+    if strategy is SimplePump:
+        from strategies import hourly
+        return np.flatnonzero(hourly.get_signal(hourly.get_features(df, strategy), pars))
+    if strategy in DAILY:
+        from strategies import vectorized
+        return np.flatnonzero(vectorized.get_entries(vectorized.get_features(df, strategy), pars))
+    return None
+
+def screen_file(args: tuple[str, Strategy, dict]) -> tuple[str, np.ndarray]:
+    filepath, strategy, pars = args
+    df = load_df(filepath)
+    if df.empty:
+        return filepath, np.array([], dtype=np.int64)
+    return filepath, get_triggers(df, strategy, pars)
+
+def screen(filepaths: list[str], strategy: Strategy, grid: dict) -> dict[str, np.ndarray]:
+    '''
+    returns {filepath: trigger bars} of the files that fire at least once (None = can't be screened, kept as is)
+    '''
+    pars = loosest(grid)
+    results = process_map(screen_file, [(fp, strategy, pars) for fp in filepaths], max_workers=mp.cpu_count(), chunksize=16, desc='Screening')
+    candidates = {fp: triggers for fp, triggers in results if triggers is None or len(triggers)}
+    print(f'{len(candidates)}/{len(filepaths)} symbols fire at {pars}')
+    return candidates
+
+def trim(df: pd.DataFrame, triggers: np.ndarray, before: int, after: int) -> pd.DataFrame:
+    if triggers is None or not len(triggers):
+        return df
+    return df.iloc[max(triggers[0] - before, 0):triggers[-1] + after + 1]
@@ -0,0 +1,136 @@
+"""
+Successive halving over the pars, instead of backtesting the whole product grid on the whole universe.
+
+n combinations are drawn from the space (a list of values per par, or a (low, high) range for the continuous ones)
+and backtested on a small random subsample of the symbols. They're scored with get_stats_batch (METRIC, score by default)
+on the trades as the extender adjusts them for stats.csv (prepare_trades), so it's the stats.csv score,
+only the best 1/eta go on to the next rung, and each rung has eta times the symbols, the last one all of them.
+Symbols are added to the subsample, never resampled, so a rung only backtests its new symbols for the survivors.
+Where exhaustive costs n * symbols backtests, this costs about n * symbols * rungs / eta ** (rungs - 1).
+    python search.py
+"""
+import numpy as np
+import pandas as pd
+import multiprocessing as mp
+import tempfile
+from backtesting import Strategy
+from tqdm import tqdm
+
+from cache import get_panel, pack
+from run import backtest_symbol_grid, get_engine, init_worker
+from stats import get_stats_batch, STATS_COLUMNS
+from stats.extender import FIXED_COLS, prepare
+
+
+METRIC = 'score'
+
+
+def sample(space: dict, n: int, rng: np.random.Generator) -> list[dict]:
+    '''
+    space - {par: [values]} to pick from, or {par: (low, high)} for a uniform draw (ints if both bounds are ints)
+    '''
+    combs = []
+    for _ in range(n):
+        comb = {}
+        for k, v in space.items():
+            if isinstance(v, tuple):
+                low, high = v
+                comb[k] = int(rng.integers(low, high + 1)) if isinstance(low, int) and isinstance(high, int) else round(float(rng.uniform(low, high)), 4)
+            else:
+                comb[k] = v[rng.integers(len(v))]
+        combs.append(comb)
+    return combs
+
+def prepare_trades(trades: pd.DataFrame) -> pd.DataFrame:
+    # the extender's trade on open and sl/tp exits (stats/extender.py main), for the strategies whose trades have the columns for them.
+    # Its grid filters aren't needed: the pars drawn here are the backtest's own thresholds
+    return prepare(trades.copy(), FIXED_COLS, trade_on_open='exit' in trades.columns, trim_pnl='sl/tp' if 'exit_reason' in trades.columns else '')[0]
+
+def score(trades: list[pd.DataFrame], combs: list[dict], metric: str = METRIC) -> np.ndarray:
+    # every combination at once, on the trades it has so far; no trades (or no score) is the worst
+    pars = list(combs[0].keys())
+    df = pd.concat([prepare_trades(t)[STATS_COLUMNS].assign(**c, _comb=i) for i, (t, c) in enumerate(zip(trades, combs)) if not t.empty], ignore_index=True)
+    scores = np.full(len(combs), -np.inf)
+    if df.empty: return scores
+    stats = get_stats_batch(df, pars + ['_comb'])
+    scores[stats['_comb'].values.astype(np.int64)] = stats[metric].fillna(-np.inf).values
+    return scores
+
+def successive_halving(dfs: list[pd.DataFrame], strategy: Strategy, space: dict, n: int = 81, eta: int = 3, min_symbols: int = 50, metric: str = METRIC, seed: int = 0) -> pd.DataFrame:
+    '''
+    returns every combination drawn, with the rung it got to (the last one = the full universe), its symbols and score there
+    '''
+    rng = np.random.default_rng(seed)
+    dfs = [dfs[i] for i in rng.permutation(len(dfs)) if not dfs[i].empty]
+    symbols = [df.attrs['symbol'] for df in dfs]
+    combs = sample(space, n, rng)
+
+    rungs = 1
+    while eta ** rungs <= n and len(dfs) / eta ** rungs >= min_symbols:
+        rungs += 1
+    sizes = [int(np.ceil(len(dfs) / eta ** (rungs - 1 - r))) for r in range(rungs)]
+
+    trades = [pd.DataFrame() for _ in combs]
+    board = pd.DataFrame(combs)
+    board['rung'], board['symbols'], board[metric] = 0, 0, -np.inf
+    alive = np.arange(n)
+    backtest_grid = get_engine(strategy)
+    done = cost = 0
+    with tempfile.TemporaryDirectory() as cache_dir:
+        if backtest_grid is None:
+            pack(dfs, cache_dir)
+            pool = mp.Pool(mp.cpu_count(), initializer=init_worker, initargs=(cache_dir, strategy))
+        try:
+            for r, size in enumerate(sizes):
+                # only the symbols new to this rung
+                new = slice(done, size)
+                if backtest_grid is not None:
+                    results = [t for _, t in backtest_grid(get_panel(dfs[new]), strategy, [combs[i] for i in alive])]
+                else:
+                    per_symbol = pool.imap(backtest_symbol_grid, [(s, [combs[i] for i in alive]) for s in symbols[new]])
+                    per_symbol = [t for _, t in tqdm(per_symbol, total=size - done, desc=f'Rung {r}', leave=False)]
+                    results = [pd.concat([t[j] for t in per_symbol], ignore_index=True) for j in range(len(alive))]
+                for i, t in zip(alive, results):
+                    trades[i] = pd.concat([trades[i], t], ignore_index=True) if not trades[i].empty else t
+                cost += len(alive) * (size - done)
+                done = size
+
+                scores = score([trades[i] for i in alive], [combs[i] for i in alive], metric)
+                board.loc[alive, 'rung'] = r
+                board.loc[alive, 'symbols'] = size
+                board.loc[alive, metric] = scores
+                print(f'rung {r}: {len(alive)} combinations on {size}/{len(dfs)} symbols, best {metric} {scores.max():.4f}')
+                if r < rungs - 1:
+                    keep = max(1, len(alive) // eta)
+                    alive = alive[np.argsort(-scores, kind='stable')[:keep]]
+                    for i in set(range(n)) - set(alive):
+                        trades[i] = pd.DataFrame()  # pruned, not needed anymore
+        finally:
+            if backtest_grid is None:
+                pool.close()
+                pool.join()
+
+    print(f'{cost} symbol backtests instead of {n * len(dfs)}')
+    return board.sort_values(['rung', metric], ascending=False, kind='stable').reset_index(drop=True)
+
+
+if __name__ == '__main__':
+    import os
+    from tqdm.contrib.concurrent import process_map
+    from run import load_df
+    from strategies.momopump import SimplePumpDaily_Fibo
+
+    name, strategy = 'simplepump-fibo-1', SimplePumpDaily_Fibo
+    data_dir = 'data/ohlcv-1d/backtrader'
+    dfs = process_map(load_df, [data_dir + '/' + fn for fn in os.listdir(data_dir)], max_workers=mp.cpu_count(), chunksize=16, desc='Data')
+    space = {
+        'sl_prc': (0.05, 0.6),
+        'reward': (1, 10),  # the wider values the grid never got to
+        'fibo': [0, 1, 2, 3, 4, 5],
+        'pullback': (0.1, 0.8),
+        'rvol': (2.0, 15.0),
+        'day_net_change': (0.1, 1.0),
+    }
+    board = successive_halving(dfs, strategy, space, n=243, eta=3)
+    board.to_csv(f'data/search-{name}.csv', index=False)
+    print(board.head(10).to_string())
@@ -1 +1 @@
-from .stats import get_used_bp, get_winrate_ma, get_drawdown, strip_pnl
\ No newline at end of file
+from .stats import get_used_bp, get_winrate_ma, get_drawdown, strip_pnl, strip_pnl_series, get_stats, get_stats_df, get_stats_batch, get_stats_chunked, get_mc_stats, STATS_COLUMNS, MC_RESAMPLES
@@ -1,8 +1,24 @@
 import pandas as pd
+import numpy as np
 import json
+import hashlib
 import os
+import sys
+import tempfile
+import multiprocessing as mp
+import pyarrow as pa
+import pyarrow.feather as feather
 from itertools import product
+from typing import Iterable
 from dataclasses import dataclass
+from tqdm import tqdm
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path: sys.path.append(ROOT)  # root modules (trades, utils) when run as a script from stats/
+from trades import TradeStore, PAR_PREFIX
+from utils import TRADE_COLUMNS, compact, read_trades, read_trades_chunks, CHUNK_ROWS, STREAM_ABOVE
+import profiling
+from stats import get_stats, get_stats_batch, STATS_COLUMNS, MC_RESAMPLES  # stats/stats.py when run as a script from stats/, the package otherwise
 
 
 @dataclass
@@ -12,14 +28,48 @@ class Filter:
 
 f = Filter
 
+OPS = {'>=': np.greater_equal, '>': np.greater, '<=': np.less_equal, '<': np.less, '==': np.equal, '!=': np.not_equal}
+
+def grid_masks(df: pd.DataFrame, grid: dict[str, list[Filter]]):
+    '''
+    Yields (comb, mask) for every grid combination, in the same order as product(*grid.values()).
+    Each column is compared to its thresholds once (len(values) masks instead of a df.query per cell),
+    and the masks are and-ed down the product, so a prefix is shared by all the cells under it
+    and a cell costs one & of two bool arrays no matter how fine the grid is.
+    '''
+    keys = list(grid.keys())
+    masks = {k: [OPS[v.op](df[k].values, v.val) for v in grid[k]] for k in keys}
+
+    def walk(i: int, mask: np.ndarray, comb: dict):
+        if i == len(keys):
+            yield comb, mask
+            return
+        k = keys[i]
+        for v, m in zip(grid[k], masks[k]):
+            yield from walk(i + 1, mask & m, {**comb, k: v})
+
+    yield from walk(0, np.ones(df.shape[0], dtype=bool), {})
+
+@profiling.timed()
 def extend(df: pd.DataFrame, grid: dict[str, Filter], fixed_cols: list[str] = [], trade_on_open: bool = False, trim_pnl: str = ''):
     # fixed_cols - list of columns that were actually backtested
-    pars_df = pd.DataFrame(
-        data=df['Tag'].apply(lambda x: json.loads(x.replace("'", '"'))).to_list()
-    )
-    additional_cols = [c for c in pars_df.columns if (c not in fixed_cols) and (c not in grid.keys())]
-    fixed_pars = {k: v for k, v in pars_df.iloc[0].items() if k in fixed_cols}
-    df = pd.concat([df.drop(columns=['Tag']), pars_df], axis=1)
+    df, fixed_pars = prepare(df, fixed_cols, trade_on_open, trim_pnl)
+    return extend_grid(df, grid, fixed_pars, get_additional_cols(df, grid, fixed_cols))
+
+def get_additional_cols(df: pd.DataFrame, grid: dict[str, Filter], fixed_cols: list[str]) -> list[str]:
+    return [c for c in df.columns if (c not in TRADE_COLUMNS) and (c not in fixed_cols) and (c not in grid.keys())]
+
+@profiling.timed()
+def prepare(df: pd.DataFrame, fixed_cols: list[str] = [], trade_on_open: bool = False, trim_pnl: str = '') -> tuple[pd.DataFrame, dict]:
+    # the part of extend() that doesn't depend on the grid
+    if 'Tag' in df.columns:
+        # raw trades written before the tags became columns (strategy.schema())
+        pars_df = pd.DataFrame(
+            data=df['Tag'].apply(lambda x: json.loads(x.replace("'", '"'))).to_list()
+        )
+        df = pd.concat([df.drop(columns=['Tag']), pars_df], axis=1)
+    tag_cols = [c for c in df.columns if c not in TRADE_COLUMNS]
+    fixed_pars = {k: v for k, v in df.iloc[0][tag_cols].items() if k in fixed_cols}
 
     # fix trade on open cuz wtf is this library
     if trade_on_open:
@@ -42,41 +92,221 @@ def extend(df: pd.DataFrame, grid: dict[str, Filter], fixed_cols: list[str] = []
         tp_mask = df['exit_reason'] == 'tp'
         df.loc[tp_mask, 'ExitPrice'] = df.loc[tp_mask, 'tp']
         df.loc[tp_mask, 'PnL'] = df.loc[tp_mask, 'Size'] * (df.loc[tp_mask, 'tp'] - df.loc[tp_mask, 'EntryPrice'])
+    return df, fixed_pars
+
+EXTENDED_COLUMNS = ['Symbol', 'Size', 'EntryBar', 'ExitBar', 'EntryPrice', 'ExitPrice', 'SL', 'TP', 'PnL', 'EntryTime', 'ExitTime', 'Duration']  # + the additional cols
 
-    k = grid.keys()
-    combs: list[dict[str, Filter]] = [dict(zip(k, v)) for v in product(*grid.values())]
+@profiling.timed()
+def extend_grid(df: pd.DataFrame, grid: dict[str, Filter], fixed_pars: dict, additional_cols: list[str]) -> list[dict]:
+    out = df[EXTENDED_COLUMNS + additional_cols]
     dfs = []
-    for comb in combs:
-        cdf = df.query(
-            ' and '.join([f'{k} {v.op} {v.val}' for k, v in comb.items()])
-        )
+    for comb, mask in grid_masks(df, grid):
         dfs.append({
             'pars': {**{k: v.val for k, v in comb.items()}, **fixed_pars},
-            'df': cdf[['Symbol', 'Size', 'EntryBar', 'ExitBar', 'EntryPrice', 'ExitPrice', 'SL', 'TP', 'PnL', 'EntryTime', 'ExitTime', 'Duration', *additional_cols]]
+            'df': out[mask]
         })
     return dfs
 
 
 tdir = os.path.abspath(os.pardir) + '/data/trades-simplepump-ocprc-1'
 
-def extend_file(filepath):
-    trades = pd.read_csv(filepath)
-    
-    edfs = extend(trades, {
-        'day_net_change': [f(0.2, '>='), f(0.3, '>='), f(0.4, '>='), f(0.5, '>='), f(0.75, '>='), f(1, '>=')],
-        'rvol': [f(3, '>='), f(4, '>='), f(5, '>='), f(7, '>='), f(10, '>=')],
-        'pullback': [f(0.6, '<='), f(0.5, '<='), f(0.4, '<='), f(0.3, '<='), f(0.2, '<='), f(0.1, '<=')],
-    }, ['sl_prc', 'reward'], trade_on_open=True, trim_pnl='sl/tp')
+GRID = {
+    'day_net_change': [f(0.2, '>='), f(0.3, '>='), f(0.4, '>='), f(0.5, '>='), f(0.75, '>='), f(1, '>=')],
+    'rvol': [f(3, '>='), f(4, '>='), f(5, '>='), f(7, '>='), f(10, '>=')],
+    'pullback': [f(0.6, '<='), f(0.5, '<='), f(0.4, '<='), f(0.3, '<='), f(0.2, '<='), f(0.1, '<=')],
+}
+FIXED_COLS = ['sl_prc', 'reward']
+
+FUSED = True  # extend and compute the stats in memory, straight into {tdir}/stats.csv
+MATERIALIZE = False  # also write the extended trades when FUSED
+SPLIT = 2  # a task is one raw file (or raw.parquet combination) and one value of each of the first SPLIT keys of GRID
 
+def extended_path(pars: dict) -> str:
+    # a whole float as an int: the fixed pars come from the float tag columns, reward=2 stays trades-...-reward=2.csv
+    fmt = lambda v: str(int(v)) if isinstance(v, float) and v.is_integer() else str(v)
+    edf_fpath = tdir + '/extended/' + 'trades-' + '-'.join([k + '=' + fmt(v) for k, v in pars.items()]) + '.csv'
+    return edf_fpath.replace('sl/tp', 'sltp')  # kosstiliki cuz i zaebavsya
+
+def write_extended(edfs: list[dict]):
     for edf in edfs:
-        edf_fpath = tdir + '/extended/' + 'trades-' + '-'.join([k + '=' + str(v) for k, v in edf['pars'].items()]) + '.csv'
-        edf_fpath = edf_fpath.replace('sl/tp', 'sltp')  # kosstiliki cuz i zaebavsya
+        edf_fpath = extended_path(edf['pars'])
         if os.path.exists(edf_fpath): continue
         edf['df'].to_csv(edf_fpath, index=False)
 
+@profiling.timed()
+def get_extended_stats(edfs: list[dict]) -> list[dict]:
+    # same rows stats.get_stats gives for the extended files, without the round trip through them
+    edfs = [edf for edf in edfs if not edf['df'].empty]
+    if not edfs: return []
+    pars = list(edfs[0]['pars'].keys())
+    df = pd.concat([edf['df'][STATS_COLUMNS].assign(**edf['pars']) for edf in edfs], ignore_index=True)
+    return get_stats_batch(df, pars, MC_RESAMPLES).to_dict('records')
+
+def extend_file(filepath):
+    if os.path.getsize(filepath) > STREAM_ABOVE:
+        extend_file_chunked(filepath)
+        return
+    trades = read_trades(filepath)
+    
+    edfs = extend(trades, GRID, FIXED_COLS, trade_on_open=True, trim_pnl='sl/tp')
+
+    write_extended(edfs)
+
+def extend_file_chunked(filepath: str, chunksize: int = CHUNK_ROWS) -> list[str]:
+    '''
+    extend_file for raw files too big to load. The filters only look at their own row, so the raws are read chunksize
+    at a time and each combination's trades of a chunk are appended to its file: a worker holds a chunk and one
+    combination of it, whatever the size of the file. The files are written aside and renamed once complete,
+    the ones already there are skipped (like write_extended).
+    returns the paths of the extended files with trades (the empty ones are written too, but have no stats, see get_extended_stats)
+    '''
+    paths, trades = {}, {}
+    for chunk in read_trades_chunks(filepath, chunksize=chunksize):
+        df, fixed_pars = prepare(chunk, FIXED_COLS, trade_on_open=True, trim_pnl='sl/tp')
+        out = df[EXTENDED_COLUMNS + get_additional_cols(df, GRID, FIXED_COLS)]
+        for comb, mask in grid_masks(df, GRID):
+            path = extended_path({**{k: v.val for k, v in comb.items()}, **fixed_pars})
+            if path not in paths:
+                paths[path] = None if os.path.exists(path) else path + '.partial'
+                if paths[path]: out.iloc[:0].to_csv(paths[path], index=False)
+                trades[path] = 0
+            if paths[path]:
+                # a fixed format: left to itself to_csv drops the time of a chunk that's all midnights
+                out[mask].to_csv(paths[path], mode='a', header=False, index=False, date_format='%Y-%m-%d %H:%M:%S')
+                trades[path] += mask.sum()
+    for path, tmp in paths.items():
+        if tmp: os.replace(tmp, path)
+    return [path for path, tmp in paths.items() if (trades[path] if tmp else has_trades(path))]
+
+def has_trades(filepath: str) -> bool:
+    # more than the header, without reading the file
+    with open(filepath) as file:
+        return bool(file.readline() and file.readline().strip())
+
+def read_raw(pars: dict) -> pd.DataFrame:
+    trades = TradeStore(tdir + '/raw.parquet').read(filter=pars)
+    return trades.drop(columns=[c for c in trades.columns if c.startswith(PAR_PREFIX)])
+
+def init_worker(table_path: str):
+    # the prepared raw trades of every file, memory mapped: loaded once for the whole pool, not per task
+    global table
+    table = feather.read_table(table_path, memory_map=True)
+
+def get_splits() -> list[dict]:
+    return [dict(zip(GRID.keys(), values)) for values in product(*list(GRID.values())[:SPLIT])]
+
+def task_marker(fixed_pars: dict, split: dict) -> str:
+    # written once all the trades of a (raw, split) task are in extended.parquet; _ dirs are skipped by the readers
+    task = json.dumps({**{k: float(v) for k, v in fixed_pars.items()}, **{k: float(v.val) for k, v in split.items()}}, sort_keys=True)
+    return tdir + '/extended.parquet/_tasks/' + hashlib.sha1(task.encode()).hexdigest()
+
+def extend_task(args: tuple) -> list[dict]:
+    (start, end), fixed_pars, additional_cols, split, sink, fused = args
+    df = table.slice(start, end - start).to_pandas()
+    grid = {k: [split[k]] if k in split else v for k, v in GRID.items()}
+    edfs = extend_grid(df, grid, fixed_pars, additional_cols)
+
+    if sink == 'csv':
+        write_extended(edfs)
+    elif sink == 'parquet':
+        with TradeStore(tdir + '/extended.parquet', partitioning=FIXED_COLS) as store:
+            for edf in edfs:
+                store.write(edf['pars'], edf['df'])
+        os.makedirs(os.path.dirname(task_marker(fixed_pars, split)), exist_ok=True)
+        open(task_marker(fixed_pars, split), 'w').close()
+    return get_extended_stats(edfs) if fused else []
+
+def drop_unfinished(fixed_pars: dict, todo: list[dict]):
+    # what an interrupted run left of the tasks about to run again, so their trades aren't in extended.parquet twice
+    store = TradeStore(tdir + '/extended.parquet', partitioning=FIXED_COLS)
+    if len(todo) == len(get_splits()):
+        store.drop(fixed_pars)  # none of the partition is done, its files just go
+        return
+    for split in todo:
+        store.drop({**fixed_pars, **{k: v.val for k, v in split.items()}})
+
+def extend_all(raws: Iterable[pd.DataFrame], sinks: list[str], fused: bool = True) -> list[dict]:
+    '''
+    Extends every raw trades frame over GRID on a pool, in (raw, first SPLIT grid values) tasks, so all the cores are busy
+    even with a handful of raw files. The raws are prepared one at a time and appended to one memory mapped table
+    shared with the workers, so only one of them is ever in memory here (pass them as a generator).
+    sinks - per raw, write its extended trades to 'csv' ({tdir}/extended) or 'parquet' ({tdir}/extended.parquet), None - don't.
+    The parquet tasks already done (task_marker) aren't written again, the ones half written are dropped first
+    fused - return their stats (get_stats rows)
+    '''
+    splits = get_splits()
+    tasks, offset, columns, additional_cols, writer, schema = [], 0, None, None, None, None
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for raw, sink in zip(raws, sinks):
+            if raw.empty: continue
+            df, fixed_pars = prepare(raw, FIXED_COLS, trade_on_open=True, trim_pnl='sl/tp')
+            del raw
+            if columns is None:
+                columns, additional_cols = list(df.columns), get_additional_cols(df, GRID, FIXED_COLS)
+            elif set(df.columns) != set(columns):
+                raise ValueError(f'raw trades of {fixed_pars} have other columns than the first ones: {sorted(set(df.columns) ^ set(columns))}')
+            df = compact(df[columns])
+            df = df.astype({col: str for col in df.columns[[isinstance(dtype, pd.CategoricalDtype) for dtype in df.dtypes]]})  # a file can't change its dictionaries
+            batch = pa.Table.from_pandas(df, preserve_index=False)
+            if writer is None:
+                schema = batch.schema
+                writer = pa.ipc.new_file(tmp_dir + '/raw.feather', schema)
+            batch = batch.cast(schema)
+            writer.write_table(batch)
+
+            todo = []
+            for split in splits:
+                task_sink = sink
+                if sink == 'parquet' and os.path.exists(task_marker(fixed_pars, split)):
+                    task_sink = None
+                if task_sink is None and not fused: continue
+                if task_sink == 'parquet': todo.append(split)
+                tasks.append(((offset, offset + df.shape[0]), fixed_pars, additional_cols, split, task_sink, fused))
+            if todo: drop_unfinished(fixed_pars, todo)
+            offset += df.shape[0]
+            del df, batch
+        if writer is None: return []
+        writer.close()
+
+        per_task = int(np.prod([len(v) for v in list(GRID.values())[SPLIT:]]))
+        stats = []
+        with mp.Pool(os.cpu_count(), initializer=init_worker, initargs=(tmp_dir + '/raw.feather',)) as pool, \
+             tqdm(total=len(tasks) * per_task, desc='Extending', unit='comb') as pbar:
+            for rows in pool.imap(extend_task, tasks):
+                stats.extend(rows)
+                pbar.update(per_task)
+    return stats
+
+
+def main():
+    write = not FUSED or MATERIALIZE
+    big = []
+    if os.path.exists(tdir + '/raw.parquet'):
+        combs = TradeStore(tdir + '/raw.parquet').combinations()
+        if not FUSED:
+            # only the raws with a task left to do, see extend_all
+            is_done = lambda pars: all(os.path.exists(task_marker({k: pars[k] for k in FIXED_COLS}, split)) for split in get_splits())
+            combs = [pars for pars in combs if not is_done(pars)]
+        raws = (read_raw(pars) for pars in tqdm(combs, desc='Raw'))
+        sinks = ['parquet' if write else None] * len(combs)
+    else:
+        fnames = os.listdir(tdir + '/raw')
+        # the ones too big to load go through extend_file_chunked/get_stats_chunked instead, via the extended files
+        big = [tdir + '/raw/' + fname for fname in fnames if os.path.getsize(tdir + '/raw/' + fname) > STREAM_ABOVE]
+        fnames = [fname for fname in fnames if tdir + '/raw/' + fname not in big]
+        raws = (read_trades(tdir + '/raw/' + fname) for fname in tqdm(fnames, desc='Raw'))
+        if write or big: os.makedirs(tdir + '/extended', exist_ok=True)
+        sinks = ['csv' if write else None] * len(fnames)
+    stats = extend_all(raws, sinks, FUSED)
+    if big:
+        from tqdm.contrib.concurrent import process_map
+        paths = sum(process_map(extend_file_chunked, big, max_workers=os.cpu_count(), chunksize=1, desc='Extending chunked'), [])
+        if FUSED:
+            stats += process_map(get_stats, paths, max_workers=os.cpu_count(), chunksize=1, desc='Stats')
+    if FUSED:
+        pd.DataFrame(data=stats).to_csv(tdir + '/stats.csv', index=False)
+
 
 if __name__ == '__main__':
-    from tqdm.contrib.concurrent import process_map
-    trades = [tdir + '/raw/' + fname for fname in os.listdir(tdir + '/raw')]
-    process_map(extend_file, trades, max_workers=os.cpu_count())
-        
\ No newline at end of file
+    with profiling.session('extender'):
+        main()
@@ -0,0 +1,84 @@
+'''
+Row by row versions of the stats.py helpers, as they were before being vectorized, and check() comparing both.
+    python stats/regression.py [extended_dir]
+'''
+import pandas as pd
+import numpy as np
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path: sys.path.append(ROOT)  # root modules (trades, utils) when run as a script from stats/
+from stats import get_used_bp, get_winrate_ma, strip_pnl, strip_pnl_series
+
+
+def get_used_bp_rows(df: pd.DataFrame):
+    events = []
+    for _, row in df.iterrows():
+        position_cost = row['Size'] * row['EntryPrice']
+        events.append((row['EntryTime'], position_cost))
+        events.append((row['ExitTime'], -position_cost))
+
+    events_df = pd.DataFrame(events, columns=['Time', 'Change'])
+    events_df = events_df.sort_values(by='Time')
+    events_df['Change'] = events_df['Change'].cumsum()
+
+    return events_df
+
+def get_winrate_ma_rows(df: pd.DataFrame, window: int = 100):
+    wins = df['PnL'].apply(lambda x: 1 if x > 0 else 0)
+    return wins.rolling(window).mean()
+
+def used_bp_by_time(events_df: pd.DataFrame) -> pd.Series:
+    # the used bp once all the events of a time are in. The order of the events of the same time (an exit and an entry at
+    # the same bar) is the sort's: the baseline's quicksort leaves it arbitrary, get_used_bp keeps them in the ExitTime order of
+    # the trades, entry before exit. So the running max within a time can differ (max_used_bp), the value after it can't
+    return events_df.groupby('Time', sort=True)['Change'].last()
+
+def get_loss_rows(df: pd.DataFrame):
+    return df['PnL'].apply(lambda x: 1 if x < 0 else 0)
+
+def get_fixture(n: int = 2000, seed: int = 0) -> pd.DataFrame:
+    # trades with the edge cases: zero/NaN PnL, exactly capped PnL, entries and exits at the same time
+    rng = np.random.default_rng(seed)
+    entry = pd.Timestamp('2020-01-01') + pd.to_timedelta(rng.integers(0, 1000, n), unit='D')
+    df = pd.DataFrame({
+        'Size': rng.integers(1, 500, n),
+        'EntryPrice': rng.uniform(1, 50, n).round(3),
+        'PnL': rng.normal(0, 150, n).round(2),
+        'EntryTime': entry,
+        'ExitTime': entry + pd.to_timedelta(rng.integers(0, 3, n), unit='D'),
+    })
+    df.loc[::17, 'PnL'] = 0
+    df.loc[::23, 'PnL'] = np.nan
+    df.loc[::29, 'PnL'] = 200
+    df.loc[::31, 'PnL'] = -100
+    return df
+
+def check(dfs: list[pd.DataFrame], sl_prc: float = 0.1, reward: float = 2) -> bool:
+    ok = True
+    for i, df in enumerate(dfs):
+        for name, expected, actual in [
+            ('strip_pnl', df['PnL'].apply(strip_pnl, args=(sl_prc, reward)), strip_pnl_series(df['PnL'], sl_prc, reward)),
+            ('loss', get_loss_rows(df), (df['PnL'] < 0).astype(np.int64)),
+            ('get_winrate_ma', get_winrate_ma_rows(df), get_winrate_ma(df)),
+            ('get_used_bp', used_bp_by_time(get_used_bp_rows(df)), used_bp_by_time(get_used_bp(df))),
+        ]:
+            try:
+                if isinstance(expected, pd.DataFrame):
+                    pd.testing.assert_frame_equal(expected, actual)
+                else:
+                    pd.testing.assert_series_equal(expected, actual)
+            except AssertionError as e:
+                ok = False
+                print(f'{name} differs on #{i}:', e)
+    return ok
+
+
+if __name__ == '__main__':
+    dfs = [get_fixture(seed=seed) for seed in range(5)] + [get_fixture(n=1)]
+    if len(sys.argv) > 1:
+        for fname in os.listdir(sys.argv[1]):
+            df = pd.read_csv(sys.argv[1] + '/' + fname, parse_dates=['EntryTime', 'ExitTime'])
+            if not df.empty: dfs.append(df)
+    print('ok' if check(dfs) else 'MISMATCH')
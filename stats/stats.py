@@ -1,5 +1,13 @@
 import pandas as pd
+import numpy as np
 import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path: sys.path.append(ROOT)  # root modules (trades, utils) when run as a script from stats/
+import profiling
+from utils import read_trades, read_trades_chunks, CHUNK_ROWS, STREAM_ABOVE
 
 
 def strip_pnl(x, sl_prc, reward, bp=1000):
@@ -9,15 +17,21 @@ def strip_pnl(x, sl_prc, reward, bp=1000):
         return -sl_prc * bp
     return x
 
+def strip_pnl_series(pnl: pd.Series, sl_prc, reward, bp=1000) -> pd.Series:
+    # strip_pnl for a whole column
+    cap, floor = sl_prc * bp * reward, -sl_prc * bp
+    return pd.Series(np.select([(pnl > 0) & (pnl > cap), (pnl < 0) & (pnl < floor)], [cap, floor], pnl), index=pnl.index, name=pnl.name)
+
 def get_used_bp(df: pd.DataFrame):
-    events = []
-    for _, row in df.iterrows():
-        position_cost = row['Size'] * row['EntryPrice']
-        events.append((row['EntryTime'], position_cost))
-        events.append((row['ExitTime'], -position_cost))
-    
-    events_df = pd.DataFrame(events, columns=['Time', 'Change'])
-    events_df = events_df.sort_values(by='Time')
+    # entry and exit event of each trade, one after another, same as appending them row by row
+    cost = (df['Size'] * df['EntryPrice']).values
+    events_df = pd.DataFrame({
+        'Time': np.column_stack([df['EntryTime'].values, df['ExitTime'].values]).ravel(),
+        'Change': np.column_stack([cost, -cost]).ravel(),
+    })
+    # ties keep the trade order, so it's reproducible (see get_stats_batch). The old quicksort left them in any order,
+    # so max_used_bp can differ from it where an exit and an entry fall on the same time (see regression.used_bp_by_time)
+    events_df = events_df.sort_values(by='Time', kind='stable')
     events_df['Change'] = events_df['Change'].cumsum()
     
     return events_df
@@ -30,27 +44,38 @@ def get_drawdown(df: pd.DataFrame):
     return ec.cummax() - ec
 
 def get_winrate_ma(df: pd.DataFrame, window: int = 100):
-    wins = df['PnL'].apply(lambda x: 1 if x > 0 else 0)
+    wins = (df['PnL'] > 0).astype(np.int64)
     return wins.rolling(window).mean()
 
-def get_stats(filepath: str) -> dict:
+def get_pars(filepath: str) -> dict:
+    # trades-sl_prc=0.1-reward=2.csv -> {'sl_prc': 0.1, 'reward': 2.0}
     filename = os.path.basename(filepath)
     pars = {}
     for p in filename[:-4].split('-')[1:]:
         k, v = p.split('=')
         pars[k] = float(v)
-    df = pd.read_csv(filepath)
+    return pars
 
+@profiling.timed()
+def get_stats(filepath: str) -> dict:
+    if os.path.getsize(filepath) > STREAM_ABOVE:
+        return get_stats_chunked(filepath)
+    df = read_trades(filepath, usecols=STATS_COLUMNS)
+    return get_stats_df(df, get_pars(filepath), MC_RESAMPLES)
+
+@profiling.timed()
+def get_stats_df(df: pd.DataFrame, pars: dict, mc: int = 0) -> dict:
+    # mc - resamples of the trades for the mc_* percentile columns (get_mc_stats), 0 - none
     stats = {}
 
     if 'sl_prc' in pars.keys():
-        df['PnL'] = df['PnL'].apply(strip_pnl, args=(pars['sl_prc'], pars['reward']))
+        df['PnL'] = strip_pnl_series(df['PnL'], pars['sl_prc'], pars['reward'])
         df['rmult'] = df['PnL'] / (df['Size'] * df['EntryPrice'] * pars['sl_prc'])
     else:
         df['rmult'] = df['PnL'] / df[df['PnL'] < 0]['PnL'].mean()
     df['EntryTime'] = pd.to_datetime(df['EntryTime'])
     df['ExitTime'] = pd.to_datetime(df['ExitTime'])
-    df = df.sort_values('ExitTime')
+    df = df.sort_values('ExitTime', kind='stable')
     df['NetPnL'] = df['PnL'] - df['Size'] * 0.014
     df['EC'] = df['PnL'].cumsum()
     df['NetEC'] = df['NetPnL'].cumsum()
@@ -60,7 +85,7 @@ def get_stats(filepath: str) -> dict:
     stats['total_trades'] = df.shape[0]
     stats['total_volume'] = df['Size'].sum()
 
-    df['loss'] = df['PnL'].apply(lambda x: 1 if x < 0 else 0)
+    df['loss'] = (df['PnL'] < 0).astype(np.int64)
     df['streak'] = (df['loss'] != df['loss'].shift()).cumsum()  # basically creates an index for each lossing streak
     stats['max_lossing_streak'] = df.groupby('streak')['loss'].sum().max()
 
@@ -82,7 +107,7 @@ def get_stats(filepath: str) -> dict:
     days = (df.index[-1] - df.index[0]).days
     years = days / 365
     growth = df['NetEC'].iloc[-1] / df['NetEC'].iloc[0]
-    stats['cagr'] = growth ** (1 / years) - 1 if growth > 0 else 0
+    stats['cagr'] = (growth ** (1 / years) - 1 if growth > 0 else 0) if years else np.nan  # all the exits on one day: no rate
 
     daily_returns = df['NetEC'].resample('D').last().pct_change(fill_method=None).dropna()
     stats['sharpe'] = daily_returns.mean() / daily_returns.std() * (252**0.5)
@@ -92,25 +117,546 @@ def get_stats(filepath: str) -> dict:
 
     stats['score'] = stats['cagr'] * stats['sharpe'] / (stats['ulcer'] + 1e-6)
 
+    if mc:
+        stats.update(get_mc_stats(df['PnL'].values, df['NetPnL'].values, df.index.values.astype('datetime64[D]'), years, mc))
+
+    return {**pars, **stats}
+
+STATS_COLUMNS = ['Size', 'EntryPrice', 'PnL', 'EntryTime', 'ExitTime']
+# what get_stats_df gives after the pars, in its order (+ the mc_* columns with a monte carlo)
+STATS_FIELDS = ['PnL', 'NetPnL', 'winrate', 'total_trades', 'total_volume', 'max_lossing_streak', 'max_drawdown', 'max_used_bp', 'sqn',
+                'std_profit', 'std_loss', 'avg_profit', 'avg_loss', 'avg_day_profit', 'std_day_profit', 'cagr', 'sharpe', 'ulcer', 'score']
+
+MC_RESAMPLES = 1000  # per combination, for the stats.csv written by the scripts
+MC_METHOD = 'bootstrap'  # 'bootstrap' - the days drawn with replacement, 'shuffle' - the same days in a random order
+MC_PERCENTILES = [5, 50, 95]
+MC_METRICS = ['max_drawdown', 'ulcer', 'cagr', 'max_lossing_streak']
+MC_SEED = 0  # the same draws for every combination, so its mc_* columns don't depend on what it was batched with
+MC_CHUNK = 200000  # resamples * trades in memory at once
+
+def get_mc_indices(draws: np.ndarray, block_start: np.ndarray, block_len: np.ndarray, n: int) -> np.ndarray:
+    '''
+    draws - (resamples, blocks) block numbers, returns the (resamples, n) trade indices of the blocks one after another,
+    cut to n trades (or wrapped around if they came up short)
+    '''
+    lens = block_len[draws].ravel()
+    # every row's blocks expanded into one flat run of trade indices, an arange per block
+    first = np.cumsum(lens) - lens
+    flat = np.arange(lens.sum()) - np.repeat(first - block_start[draws.ravel()], lens)
+    total = block_len[draws].sum(axis=1)
+    row_start = np.cumsum(total) - total
+    pos = row_start[:, None] + np.arange(n)
+    short = np.flatnonzero(total < n)
+    pos[short] = row_start[short, None] + np.arange(n) % total[short, None]
+    return flat[pos]
+
+def get_mc_stats(pnl: np.ndarray, net_pnl: np.ndarray, day: np.ndarray, years: float, resamples: int = MC_RESAMPLES, method: str = MC_METHOD, seed: int = MC_SEED) -> dict:
+    '''
+    Is the drawdown/ulcer/cagr/streak of a combination luck? Its trades (sorted by ExitTime, PnL already capped)
+    are resampled by day, whole days of trades at a time so the trades of a day stay together, and every metric is computed
+    like get_stats does for all the resamples at once, as (resamples, trades) arrays.
+    returns the MC_PERCENTILES of each, mc_{metric}_p{q}
+    '''
+    n = len(pnl)
+    block_start = np.flatnonzero(np.r_[True, day[1:] != day[:-1]])
+    block_len = np.diff(np.r_[block_start, n])
+    rng = np.random.default_rng(seed)
+    metrics = {k: [] for k in MC_METRICS}
+    chunk = max(1, MC_CHUNK // max(n, 1))
+    for done in range(0, resamples, chunk):
+        rows = min(chunk, resamples - done)
+        if method == 'shuffle':
+            draws = rng.random((rows, len(block_start))).argsort(axis=1)
+        else:
+            # a few more days than it has, so a resample hardly ever comes up short of n trades
+            draws = rng.integers(0, len(block_start), (rows, len(block_start) + len(block_start) // 4 + 8))
+        idx = get_mc_indices(draws, block_start, block_len, n)
+        p = pnl[idx]
+        # in place where it can be: these are the big arrays
+        ec = p.cumsum(axis=1)
+        peak = np.maximum.accumulate(ec, axis=1)
+        metrics['max_drawdown'].append(np.subtract(peak, ec, out=peak).max(axis=1))
+        net_ec = net_pnl[idx].cumsum(axis=1, out=ec)
+        peak = np.maximum.accumulate(net_ec, axis=1, out=peak)
+        with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+            growth = net_ec[:, -1] / net_ec[:, 0]
+            metrics['cagr'].append(np.where(growth > 0, growth ** (1 / years) - 1, 0) if years else np.full(rows, np.nan))
+            drawdowns = np.divide(net_ec, peak, out=peak)
+            drawdowns -= 1
+            drawdowns *= drawdowns
+            metrics['ulcer'].append(np.sqrt(np.nanmean(drawdowns, axis=1)) * 100)
+        # losses so far minus the ones before the last win: the current streak
+        lost = p < 0
+        losses = lost.cumsum(axis=1, dtype=np.int32)
+        before = np.maximum.accumulate(np.where(lost, 0, losses), axis=1)
+        metrics['max_lossing_streak'].append(np.subtract(losses, before, out=losses).max(axis=1))
+
+    return get_mc_percentiles(metrics, n)
+
+def get_mc_percentiles(metrics: dict[str, list[np.ndarray]], n: int) -> dict:
+    stats = {}
+    for k, v in metrics.items():
+        v = np.concatenate(v).astype(np.float64) if n else np.array([np.nan])
+        with np.errstate(invalid='ignore'):
+            values = np.nanpercentile(v, MC_PERCENTILES) if not np.isnan(v).all() else [np.nan] * len(MC_PERCENTILES)  # e.g. the cagr of a single day
+        stats.update({f'mc_{k}_p{q}': x for q, x in zip(MC_PERCENTILES, values)})
+    return stats
+
+def get_days(pnl: np.ndarray, net_pnl: np.ndarray, day: np.ndarray) -> dict[str, np.ndarray]:
+    '''
+    What get_mc_days needs of every calendar day of trades sorted by ExitTime (NaN PnL as 0): its count, sums,
+    the highest/lowest point and the drawdown of its own equity curve (from 0 at the start of the day), its first net PnL,
+    and its losing streaks: leading (= count if every trade lost), trailing and longest.
+    '''
+    n = len(pnl)
+    pnl, net_pnl = np.nan_to_num(pnl), np.nan_to_num(net_pnl)
+    if not n: return {'day': day, **{k: np.array([], dtype=np.float64) for k in ['pnl', 'max', 'min', 'drawdown', 'net_pnl', 'net_max', 'first_net']},
+                      **{k: np.array([], dtype=np.int64) for k in ['n', 'lead', 'trail', 'streak']}}
+    # the days are contiguous: reduceat over their starts, and running values restarted at each one
+    starts = np.flatnonzero(np.r_[True, day[1:] != day[:-1]])
+    counts = np.diff(np.r_[starts, n])
+    ends = starts + counts - 1
+    def cumsum(x):
+        total = np.cumsum(x)
+        return total - np.repeat(total[starts] - x[starts], counts)
+    ec, net_ec = cumsum(pnl), cumsum(net_pnl)
+    lost = pnl < 0
+    losses = cumsum(lost.astype(np.int64))
+    running = pd.DataFrame({'ec': ec, 'losses': np.where(lost, 0, losses)}).groupby(np.repeat(np.arange(len(starts)), counts)).cummax()
+    streak = losses - running['losses'].values  # the losing streak each trade is in
+    return {
+        'day': day[starts], 'n': counts,
+        'pnl': ec[ends], 'max': np.maximum.reduceat(ec, starts), 'min': np.minimum.reduceat(ec, starts),
+        'drawdown': np.maximum.reduceat(running['ec'].values - ec, starts),
+        'net_pnl': net_ec[ends], 'net_max': np.maximum.reduceat(net_ec, starts), 'first_net': net_pnl[starts],
+        'lead': np.add.reduceat(cumsum((~lost).astype(np.int64)) == 0, starts).astype(np.int64),
+        'trail': streak[ends], 'streak': np.maximum.reduceat(streak, starts),
+    }
+
+def concat_days(parts: list[dict[str, np.ndarray]]) -> dict[str, np.ndarray]:
+    # get_days of consecutive blocks of trades, the day split between two blocks put back together
+    out = {k: [v] for k, v in parts[0].items()}
+    for part in parts[1:]:
+        if not len(part['day']): continue
+        if len(out['day'][-1]) and out['day'][-1][-1] == part['day'][0]:
+            a = {k: v[-1][-1] for k, v in out.items()}
+            b = {k: v[0] for k, v in part.items()}
+            day = {
+                'day': a['day'], 'n': a['n'] + b['n'],
+                'pnl': a['pnl'] + b['pnl'], 'max': max(a['max'], a['pnl'] + b['max']), 'min': min(a['min'], a['pnl'] + b['min']),
+                'drawdown': max(a['drawdown'], b['drawdown'], a['max'] - a['pnl'] - b['min']),
+                'net_pnl': a['net_pnl'] + b['net_pnl'], 'net_max': max(a['net_max'], a['net_pnl'] + b['net_max']), 'first_net': a['first_net'],
+                'lead': a['lead'] if a['lead'] < a['n'] else a['n'] + b['lead'],
+                'trail': b['trail'] if b['trail'] < b['n'] else b['n'] + a['trail'],
+                'streak': max(a['streak'], b['streak'], a['trail'] + b['lead']),
+            }
+            for k, v in out.items():
+                v[-1] = np.r_[v[-1][:-1], day[k]].astype(v[-1].dtype)
+            part = {k: v[1:] for k, v in part.items()}
+        for k, v in part.items():
+            out[k].append(v)
+    return {k: np.concatenate(v) for k, v in out.items()}
+
+def get_mc_days(days: dict[str, np.ndarray], years: float, resamples: int = MC_RESAMPLES, method: str = MC_METHOD, seed: int = MC_SEED) -> dict:
+    '''
+    get_mc_stats from the get_days aggregates, (resamples, days) arrays instead of (resamples, trades): for files too big
+    to resample trade by trade (get_stats_chunked). The days are drawn the same way and the max drawdown, losing streak
+    and cagr of a resample are exactly the ones of its trades. Two differences: a bootstrap resample ends with the day
+    that brings it to the number of trades (get_mc_stats cuts that day short), and the ulcer is the one of the equity
+    at the end of every day, weighted by its trades.
+    '''
+    n_days, n = len(days['day']), int(days['n'].sum())
+    rng = np.random.default_rng(seed)
+    metrics = {k: [] for k in MC_METRICS}
+    chunk = max(1, MC_CHUNK // max(n_days, 1))
+    for done in range(0, resamples if n_days else 0, chunk):
+        rows = min(chunk, resamples - done)
+        if method == 'shuffle':
+            draws = rng.random((rows, n_days)).argsort(axis=1)
+        else:
+            draws = rng.integers(0, n_days, (rows, n_days + n_days // 4 + 8))
+        d = {k: v[draws] for k, v in days.items() if k != 'day'}
+        keep = d['n'].cumsum(axis=1) - d['n'] < n  # the days up to n trades
+        idx = np.arange(draws.shape[1])
+        first_day = lambda x, fill: np.concatenate([np.full((rows, 1), fill, dtype=x.dtype), x[:, :-1]], axis=1)
+
+        pnl = np.where(keep, d['pnl'], 0)
+        ec = pnl.cumsum(axis=1) - pnl  # before the day
+        peak = first_day(np.maximum.accumulate(np.where(keep, ec + d['max'], -np.inf), axis=1), -np.inf)
+        metrics['max_drawdown'].append(np.where(keep, np.maximum(d['drawdown'], peak - ec - d['min']), 0).max(axis=1))
+
+        net_pnl = np.where(keep, d['net_pnl'], 0)
+        net_ec = net_pnl.cumsum(axis=1)
+        net_peak = np.maximum.accumulate(np.where(keep, net_ec - net_pnl + d['net_max'], -np.inf), axis=1)
+        with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+            growth = net_ec[:, -1] / d['first_net'][:, 0]
+            metrics['cagr'].append(np.where(growth > 0, growth ** (1 / years) - 1, 0) if years else np.full(rows, np.nan))
+            drawdowns = (net_ec / net_peak - 1) ** 2
+            weights = np.where(keep & ~np.isnan(drawdowns), d['n'], 0)
+            metrics['ulcer'].append(np.sqrt(np.nansum(drawdowns * weights, axis=1) / weights.sum(axis=1)) * 100)
+
+        # the streak at the end of each day: its trailing losses, plus the ones of the days before if it lost every trade
+        all_lost = keep & (d['lead'] == d['n'])
+        lost = np.where(all_lost, d['n'], 0).cumsum(axis=1)
+        last = np.maximum.accumulate(np.where(keep & ~all_lost, idx, -1), axis=1)  # the last day with a win
+        at = np.maximum(last, 0)
+        end = lost - np.where(last >= 0, np.take_along_axis(lost, at, axis=1) - np.take_along_axis(d['trail'], at, axis=1), 0)
+        metrics['max_lossing_streak'].append(np.where(keep, np.maximum(d['streak'], first_day(end, 0) + d['lead']), 0).max(axis=1))
+
+    return get_mc_percentiles(metrics, n)
+
+@profiling.timed()
+def get_stats_batch(df: pd.DataFrame, pars: list[str], mc: int = 0) -> pd.DataFrame:
+    '''
+    get_stats_df for every combination of one long trade table, one row per distinct value of the `pars` columns
+    (same columns as stats.csv, the mc_* ones too with mc resamples). Sorted by (combination, ExitTime) once, then every running metric (equity curve,
+    drawdown, streaks, used bp, daily resamples) is a segmented cumsum/cummax or a groupby over contiguous groups,
+    instead of a get_stats_df call per combination.
+    '''
+    if df.empty:
+        # e.g. a walk-forward window without trades: no rows, but the columns to look for
+        mc_fields = [f'mc_{k}_p{q}' for k in MC_METRICS for q in MC_PERCENTILES] if mc else []
+        return pd.DataFrame(columns=pars + STATS_FIELDS + mc_fields, dtype=np.float64)
+    gid = df.groupby(pars, sort=False, dropna=False).ngroup().values
+    entry_time = pd.to_datetime(df['EntryTime']).values
+    exit_time = pd.to_datetime(df['ExitTime']).values
+    order = np.lexsort((exit_time, gid))  # stable, same as get_stats_df's sort within a combination
+    gid, entry_time, exit_time = gid[order], entry_time[order], exit_time[order]
+    size = df['Size'].values[order]
+    entry_price = df['EntryPrice'].values[order].astype(np.float64)
+    pnl = df['PnL'].values[order].astype(np.float64)
+    par_values = {p: df[p].values[order].astype(np.float64) for p in pars}
+
+    n = len(gid)
+    starts = np.flatnonzero(np.r_[True, gid[1:] != gid[:-1]])
+    ends = np.r_[starts[1:], n] - 1
+    counts = ends - starts + 1
+    by = lambda values: pd.Series(values).groupby(gid)
+
+    if 'sl_prc' in pars:
+        sl_prc, reward = par_values['sl_prc'], par_values['reward']
+        cap, floor = sl_prc * 1000 * reward, -sl_prc * 1000
+        pnl = np.select([(pnl > 0) & (pnl > cap), (pnl < 0) & (pnl < floor)], [cap, floor], pnl)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            rmult = pnl / (size * entry_price * sl_prc)
+    else:
+        with np.errstate(divide='ignore', invalid='ignore'):
+            rmult = pnl / by(np.where(pnl < 0, pnl, np.nan)).transform('mean').values
+    net_pnl = pnl - size * 0.014
+    ec = by(pnl).cumsum().values
+    net_ec = by(net_pnl).cumsum().values
+
+    stats = pd.DataFrame({p: par_values[p][starts] for p in pars})
+    stats['PnL'] = ec[ends]
+    stats['NetPnL'] = net_ec[ends]
+    stats['winrate'] = by(pnl > 0).sum().values / counts
+    stats['total_trades'] = counts
+    stats['total_volume'] = by(size).sum().values
+
+    # runs of consecutive losses, numbered across the whole table
+    loss = (pnl < 0).astype(np.int64)
+    new_run = np.r_[True, loss[1:] != loss[:-1]]
+    new_run[starts] = True
+    run = np.cumsum(new_run) - 1
+    run_losses = np.bincount(run, weights=loss).astype(np.int64)
+    stats['max_lossing_streak'] = pd.Series(run_losses).groupby(gid[new_run]).max().values
+
+    stats['max_drawdown'] = by(by(ec).cummax().values - ec).max().values
+
+    # used bp: entry and exit event of each trade, ties in the order get_used_bp gives them
+    cost = size * entry_price
+    ev_gid = np.repeat(gid, 2)
+    ev_time = np.column_stack([entry_time, exit_time]).ravel()
+    ev_change = np.column_stack([cost, -cost]).ravel()
+    ev_order = np.lexsort((np.arange(2 * n), ev_time, ev_gid))
+    stats['max_used_bp'] = pd.Series(ev_change[ev_order]).groupby(ev_gid[ev_order]).cumsum().groupby(ev_gid[ev_order]).max().values
+
+    stats['sqn'] = by(rmult).mean().values / by(rmult).std().values * counts ** 0.5
+    stats['std_profit'] = by(np.where(pnl > 0, pnl, np.nan)).std().values
+    stats['std_loss'] = by(np.where(pnl < 0, pnl, np.nan)).std().values
+    stats['avg_profit'] = by(np.where(pnl > 0, pnl, np.nan)).mean().values
+    stats['avg_loss'] = by(np.where(pnl < 0, pnl, np.nan)).mean().values
+
+    # daily resample: calendar days from the first to the last exit, the ones without exits count as 0
+    day = exit_time.astype('datetime64[D]')
+    days = pd.DataFrame({'gid': gid, 'day': day, 'PnL': pnl, 'NetEC': net_ec}).groupby(['gid', 'day'], sort=False)
+    day_pnl = days['PnL'].sum()
+    day_gid = day_pnl.index.get_level_values('gid').values
+    n_days = (day[ends] - day[starts]).astype(np.int64) + 1
+    avg_day = day_pnl.groupby(day_gid).sum().values / n_days
+    sq = pd.Series((day_pnl.values - avg_day[day_gid]) ** 2).groupby(day_gid).sum().values
+    empty_days = n_days - day_pnl.groupby(day_gid).size().values
+    with np.errstate(divide='ignore', invalid='ignore'):
+        var_day = (sq + empty_days * avg_day ** 2) / (n_days - 1)
+    stats['avg_day_profit'] = avg_day
+    stats['std_day_profit'] = np.where(n_days > 1, np.sqrt(var_day), np.nan)
+
+    years = ((exit_time[ends] - exit_time[starts]) // np.timedelta64(1, 'D')) / 365
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        growth = net_ec[ends] / net_ec[starts]
+        stats['cagr'] = np.where(years == 0, np.nan, np.where(growth > 0, growth ** (1 / years) - 1, 0))
+
+    # daily returns only exist between two consecutive calendar days that both have exits
+    day_ec = days['NetEC'].last()
+    day_ec_gid = day_ec.index.get_level_values('gid').values
+    day_ec_day = day_ec.index.get_level_values('day').values
+    consecutive = np.r_[False, (day_ec_gid[1:] == day_ec_gid[:-1]) & (day_ec_day[1:] - day_ec_day[:-1] == np.timedelta64(1, 'D'))]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        returns = pd.Series(day_ec.values / np.r_[np.nan, day_ec.values[:-1]] - 1)
+    returns = returns[consecutive & returns.notna().values]
+    returns = returns.groupby(day_ec_gid[returns.index.values])
+    stats['sharpe'] = (returns.mean() / returns.std() * (252**0.5)).reindex(np.arange(len(starts))).values
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        drawdowns_pct = (net_ec / by(net_ec).cummax().values - 1) * 100
+    stats['ulcer'] = by(drawdowns_pct ** 2).mean().values ** 0.5
+
+    stats['score'] = stats['cagr'] * stats['sharpe'] / (stats['ulcer'] + 1e-6)
+
+    if mc:
+        mc_stats = [get_mc_stats(pnl[s:e + 1], net_pnl[s:e + 1], day[s:e + 1], y, mc) for s, e, y in zip(starts, ends, years)]
+        stats = pd.concat([stats, pd.DataFrame(mc_stats)], axis=1)
+
+    return stats
+
+def get_store_stats(path: str) -> list[dict]:
+    '''
+    get_stats for every combination of an extended TradeStore (see trades.py). Reads one partition at a time,
+    only the columns get_stats needs, and scores all the combinations inside it with get_stats_batch.
+    '''
+    from trades import TradeStore, PAR_PREFIX
+    store = TradeStore(path)
+    other_pars = [p for p in store.pars if p not in store.partitioning]
+    stats = []
+    for part in store.partitions():
+        df = store.read(columns=STATS_COLUMNS + [PAR_PREFIX + p for p in other_pars], filter=part)
+        df = df.rename(columns=lambda c: c[len(PAR_PREFIX):] if c.startswith(PAR_PREFIX) else c).assign(**part)
+        stats.extend(get_stats_batch(df, store.pars, MC_RESAMPLES).to_dict('records'))
+    return stats
+
+def spill(arrays: dict[str, np.ndarray], path: str) -> dict[str, np.ndarray]:
+    # to {path}.{name}.npy and back, memory mapped
+    for k, v in arrays.items():
+        np.save(f'{path}.{k}.npy', v)
+    return {k: np.load(f'{path}.{k}.npy', mmap_mode='r') for k in arrays}
+
+def count_up_to(block: dict[str, np.ndarray], keys: list[str], bound: tuple) -> int:
+    # rows of a block sorted by keys that are <= bound, compared key by key
+    lo, hi = 0, len(block[keys[0]])
+    for k, b in zip(keys, bound):
+        col = block[k][lo:hi]
+        lo, hi = lo + np.searchsorted(col, b, 'left'), lo + np.searchsorted(col, b, 'right')
+    return hi
+
+def merge_runs(runs: list[dict[str, np.ndarray]], keys: list[str], block: int = CHUNK_ROWS):
+    '''
+    k-way merge of runs (dicts of equally long arrays, e.g. spill()'s), each one sorted by keys, no two rows with the same keys.
+    Yields all their rows in order, a block at a time, with about `block` rows of all the runs loaded at once.
+    '''
+    block = max(1, block // max(len(runs), 1))
+    pos = [0] * len(runs)
+    bufs = [None] * len(runs)
+    while True:
+        for i, run in enumerate(runs):
+            if (bufs[i] is None or not len(bufs[i][keys[0]])) and pos[i] < len(run[keys[0]]):
+                bufs[i] = {k: np.array(v[pos[i]:pos[i] + block]) for k, v in run.items()}
+                pos[i] += len(bufs[i][keys[0]])
+        live = [i for i, buf in enumerate(bufs) if buf is not None and len(buf[keys[0]])]
+        if not live: return
+        # nothing still on disk comes before the last row loaded of its run, so everything up to the smallest one can go
+        more = [i for i in live if pos[i] < len(runs[i][keys[0]])]
+        bound = min(tuple(bufs[i][k][-1] for k in keys) for i in more) if more else None
+        parts = []
+        for i in live:
+            take = len(bufs[i][keys[0]]) if bound is None else count_up_to(bufs[i], keys, bound)
+            parts.append({k: v[:take] for k, v in bufs[i].items()})
+            bufs[i] = {k: v[take:] for k, v in bufs[i].items()}
+        out = {k: np.concatenate([part[k] for part in parts]) for k in parts[0]}
+        order = np.lexsort([out[k] for k in reversed(keys)])
+        yield {k: v[order] for k, v in out.items()}
+
+def add_moments(m: tuple, x: np.ndarray) -> tuple:
+    # (count, mean, sum of squared deviations) of the values so far and x, for a mean and std without keeping the values
+    x = x[~np.isnan(x)]
+    if not len(x): return m
+    n, mean, m2 = m
+    mx = x.mean()
+    d, total = mx - mean, n + len(x)
+    return total, mean + d * len(x) / total, m2 + ((x - mx) ** 2).sum() + d * d * n * len(x) / total
+
+def mean_of(m: tuple) -> float:
+    return m[1] if m[0] else np.nan
+
+def std_of(m: tuple) -> float:
+    return np.sqrt(m[2] / (m[0] - 1)) if m[0] > 1 else np.nan
+
+@profiling.timed()
+def get_stats_chunked(filepath: str, chunksize: int = CHUNK_ROWS, mc: int = MC_RESAMPLES) -> dict:
+    '''
+    get_stats for a file too big to load, chunksize trades at a time. The chunks are sorted by ExitTime and spilled
+    to a temp dir, then merged back (merge_runs) and every metric carries its state from one block to the next:
+    sums and moments, the equity curve and its peak, the current losing streak, a value per calendar day for the daily ones.
+    Used bp is one more merge, of the entry and exit events. The Monte Carlo resamples days (get_mc_days), from their
+    aggregates collected along the way, so it doesn't grow with the trades either.
+    '''
+    pars = get_pars(filepath)
+    with tempfile.TemporaryDirectory(ignore_cleanup_errors=True) as tmp:
+        # seq - the row in the file, so ties on ExitTime keep the file order like get_stats_df's stable sort
+        runs, rows, loss_sum, loss_count = [], 0, 0.0, 0
+        for i, df in enumerate(read_trades_chunks(filepath, STATS_COLUMNS, chunksize)):
+            pnl = df['PnL'].astype(np.float64)
+            if 'sl_prc' in pars:
+                pnl = strip_pnl_series(pnl, pars['sl_prc'], pars['reward'])
+            loss_sum += pnl[pnl < 0].sum()
+            loss_count += (pnl < 0).sum()
+            run = {
+                'ExitTime': pd.to_datetime(df['ExitTime']).values.astype('datetime64[ns]').view(np.int64),
+                'seq': np.arange(rows, rows + df.shape[0]),
+                'EntryTime': pd.to_datetime(df['EntryTime']).values.astype('datetime64[ns]').view(np.int64),
+                'Size': df['Size'].values.astype(np.int64),
+                'EntryPrice': df['EntryPrice'].values.astype(np.float64),
+                'PnL': pnl.values,
+            }
+            order = np.argsort(run['ExitTime'], kind='stable')
+            runs.append(spill({k: v[order] for k, v in run.items()}, f'{tmp}/trades-{i}'))
+            rows += df.shape[0]
+        if not rows: return pars
+
+        stats = {}
+        ec = net_ec = 0.0
+        peak = net_peak = -np.inf
+        max_drawdown = streak = max_streak = wins = volume = ulcer_n = done = 0
+        ulcer_sum = 0.0
+        rmult, profit_moments, loss_moments = (0, 0.0, 0.0), (0, 0.0, 0.0), (0, 0.0, 0.0)
+        day_pnl, day_ec, mc_days = [], [], []
+        # the exit events straight to disk, in order; the entry events are spilled in sorted runs
+        sorted_files = {k: open(f'{tmp}/sorted.{k}', 'wb') for k in ['Time', 'seq', 'Change']}
+        entries, pending, entry_runs = [], 0, []
+        for b in merge_runs(runs, ['ExitTime', 'seq'], chunksize):
+            pnl, size = b['PnL'], b['Size']
+            n = len(pnl)
+            net_pnl = pnl - size * 0.014
+            # a NaN PnL is skipped by the running sums and has no equity of its own, like pandas' cumsum/cummax in get_stats_df
+            nan = np.isnan(pnl)
+            ecs = np.cumsum(np.r_[ec, np.nan_to_num(pnl)])[1:]
+            net_ecs = np.cumsum(np.r_[net_ec, np.nan_to_num(net_pnl)])[1:]
+            peaks = np.maximum.accumulate(np.r_[peak, ecs])[1:]
+            net_peaks = np.maximum.accumulate(np.r_[net_peak, net_ecs])[1:]
+            ec, net_ec, peak, net_peak = ecs[-1], net_ecs[-1], peaks[-1], net_peaks[-1]
+            ecs[nan], net_ecs[nan] = np.nan, np.nan
+            if not done:
+                first_exit, first_net_ec = b['ExitTime'][0], net_ecs[0]
+            last_ec, last_net_ec = ecs[-1], net_ecs[-1]
+            max_drawdown = max(max_drawdown, np.max(peaks - ecs, where=~nan, initial=0))
+
+            wins += (pnl > 0).sum()
+            volume += size.sum()
+            # losses so far minus the ones before the last win, plus the streak the block started in until its first win
+            lost = pnl < 0
+            lost_so_far = lost.cumsum()
+            before = np.maximum.accumulate(np.where(lost, 0, lost_so_far))
+            streaks = lost_so_far - before + np.where((~lost).cumsum() == 0, streak, 0)
+            streak, max_streak = streaks[-1], max(max_streak, streaks.max())
+
+            with np.errstate(divide='ignore', invalid='ignore'):
+                r = pnl / (size * b['EntryPrice'] * pars['sl_prc']) if 'sl_prc' in pars else pnl / (loss_sum / loss_count if loss_count else np.nan)
+                drawdowns_pct = (net_ecs / net_peaks - 1) * 100
+            rmult = add_moments(rmult, r)
+            profit_moments = add_moments(profit_moments, pnl[pnl > 0])
+            loss_moments = add_moments(loss_moments, pnl[pnl < 0])
+            ulcer_sum += np.nansum(drawdowns_pct ** 2)
+            ulcer_n += np.count_nonzero(~np.isnan(drawdowns_pct))
+
+            day = b['ExitTime'].view('datetime64[ns]').astype('datetime64[D]')
+            day_pnl.append(pd.Series(pnl).groupby(day).sum())
+            day_ec.append(pd.Series(net_ecs).groupby(day).last())
+            if mc: mc_days.append(get_days(pnl, net_pnl, day))
+
+            # used bp events, in get_used_bp's order: by time, then entry and exit of each trade in the ExitTime order
+            seq = 2 * np.arange(done, done + n)
+            cost = size * b['EntryPrice']
+            for k, v in {'Time': b['ExitTime'], 'seq': seq + 1, 'Change': -cost}.items():
+                v.tofile(sorted_files[k])
+            entries.append({'Time': b['EntryTime'], 'seq': seq, 'Change': cost})
+            pending += n
+            if pending >= chunksize or done + n == rows:
+                entry = {k: np.concatenate([e[k] for e in entries]) for k in entries[0]}
+                order = np.lexsort((entry['seq'], entry['Time']))
+                entry_runs.append(spill({k: v[order] for k, v in entry.items()}, f'{tmp}/entries-{len(entry_runs)}'))
+                entries, pending = [], 0
+            last_exit = b['ExitTime'][-1]
+            done += n
+        for file in sorted_files.values():
+            file.close()
+        dtypes = {'Time': np.int64, 'seq': np.int64, 'Change': np.float64}
+        exits = {k: np.memmap(f'{tmp}/sorted.{k}', dtype=dtype, mode='r') for k, dtype in dtypes.items()}
+
+        used_bp, max_used_bp = 0.0, -np.inf
+        for b in merge_runs(entry_runs + [exits], ['Time', 'seq'], chunksize):
+            used = np.cumsum(np.r_[used_bp, b['Change']])[1:]
+            used_bp, max_used_bp = used[-1], max(max_used_bp, used.max())
+
+        stats['PnL'] = last_ec
+        stats['NetPnL'] = last_net_ec
+        stats['winrate'] = wins / rows
+        stats['total_trades'] = rows
+        stats['total_volume'] = volume
+        stats['max_lossing_streak'] = max_streak
+        stats['max_drawdown'] = max_drawdown
+        stats['max_used_bp'] = max_used_bp
+        stats['sqn'] = mean_of(rmult) / std_of(rmult) * (rows ** 0.5)
+        stats['std_profit'] = std_of(profit_moments)
+        stats['std_loss'] = std_of(loss_moments)
+        stats['avg_profit'] = mean_of(profit_moments)
+        stats['avg_loss'] = mean_of(loss_moments)
+
+        # a day split between two blocks is in both of them
+        day_pnl = pd.concat(day_pnl).groupby(level=0).sum()
+        day_pnl.index = pd.DatetimeIndex(day_pnl.index)
+        stats['avg_day_profit'] = day_pnl.resample('D').sum().mean()
+        stats['std_day_profit'] = day_pnl.resample('D').sum().std()
+
+        days = (pd.Timestamp(last_exit) - pd.Timestamp(first_exit)).days
+        years = days / 365
+        growth = last_net_ec / first_net_ec
+        stats['cagr'] = (growth ** (1 / years) - 1 if growth > 0 else 0) if years else np.nan
+
+        day_ec = pd.concat(day_ec).groupby(level=0).last()
+        day_ec.index = pd.DatetimeIndex(day_ec.index)
+        daily_returns = day_ec.resample('D').last().pct_change(fill_method=None).dropna()
+        stats['sharpe'] = daily_returns.mean() / daily_returns.std() * (252**0.5)
+
+        stats['ulcer'] = (ulcer_sum / ulcer_n if ulcer_n else np.nan) ** 0.5
+
+        stats['score'] = stats['cagr'] * stats['sharpe'] / (stats['ulcer'] + 1e-6)
+
+        if mc:
+            stats.update(get_mc_days(concat_days(mc_days), years, mc))
+        del exits, entry_runs, runs  # the memory maps, before the temp dir goes
+
     return {**pars, **stats}
 
 if __name__ == '__main__':
-    from tqdm.contrib.concurrent import process_map
-    import os
-    tdir = os.path.abspath(os.pardir) + '\\data\\trades-simplepump-ocprc-1'
-    def load_df(fname: str):
-        pars = {}
-        for p in fname[:-4].split('-')[1:]:
-            k, v = p.split('=')
-            pars[k] = float(v)
-        df = pd.read_csv(tdir + '\\extended\\' + fname)
-        return {'df': df, 'pars': pars}
-
-    stats = process_map(
-        get_stats,
-        [tdir + '\\extended\\' + fname for fname in os.listdir(tdir + '\\extended')],
-        max_workers=os.cpu_count(),
-        desc='STATS',
-        chunksize=1
-    )
-    pd.DataFrame(data=stats).to_csv(tdir + '\\stats.csv', index=False)
\ No newline at end of file
+    with profiling.session('stats'):
+        from tqdm.contrib.concurrent import process_map
+        import os
+        tdir = os.path.abspath(os.pardir) + '\\data\\trades-simplepump-ocprc-1'
+        if os.path.exists(tdir + '\\extended.parquet'):
+            pd.DataFrame(data=get_store_stats(tdir + '\\extended.parquet')).to_csv(tdir + '\\stats.csv', index=False)
+            sys.exit()
+        def load_df(fname: str):
+            pars = {}
+            for p in fname[:-4].split('-')[1:]:
+                k, v = p.split('=')
+                pars[k] = float(v)
+            df = pd.read_csv(tdir + '\\extended\\' + fname)
+            return {'df': df, 'pars': pars}
+
+        stats = process_map(
+            get_stats,
+            [tdir + '\\extended\\' + fname for fname in os.listdir(tdir + '\\extended')],
+            max_workers=os.cpu_count(),
+            desc='STATS',
+            chunksize=1
+        )
+        pd.DataFrame(data=stats).to_csv(tdir + '\\stats.csv', index=False)
\ No newline at end of file
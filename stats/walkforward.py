@@ -0,0 +1,131 @@
+'''
+Walk-forward: instead of picking the pars by the stats of the whole history (in sample), the EntryTime range is split
+into rolling windows, the best combination of each train window (by METRIC) is picked and only traded on the test
+window right after it. The test windows' trades, one after another, are the out of sample equity curve.
+
+Every window of every combination is scored at once, one get_stats_batch over the window's slice of the trades,
+and cached in {tdir}/walkforward/ under a fingerprint of the slice: a nightly rerun only scores the new windows
+(and any window whose trades changed).
+    python stats/walkforward.py
+'''
+import pandas as pd
+import numpy as np
+import hashlib
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path: sys.path.append(ROOT)  # root modules (trades, utils) when run as a script from stats/
+from trades import TradeStore, PAR_PREFIX
+from utils import read_trades
+from stats import get_stats_batch, get_stats_df, strip_pnl_series, STATS_COLUMNS
+
+
+tdir = os.path.abspath(os.pardir) + '/data/trades-simplepump-ocprc-1'
+
+TRAIN = pd.DateOffset(years=2)
+TEST = pd.DateOffset(months=6)  # also the step: the test windows follow each other
+METRIC = 'score'  # stats.csv column to pick by, highest first
+MIN_TRADES = 30  # in the train window, so a lucky handful of trades doesn't win
+
+
+def read_extended(tdir: str) -> tuple[pd.DataFrame, list[str]]:
+    '''
+    Every combination's trades in one long table (STATS_COLUMNS + a column per par), and the pars.
+    From extended.parquet or the extended csvs; with the extender in FUSED mode neither exists,
+    so the raws are extended in memory instead.
+    '''
+    if os.path.exists(tdir + '/extended.parquet'):
+        store = TradeStore(tdir + '/extended.parquet')
+        df = store.read(columns=STATS_COLUMNS + [PAR_PREFIX + p for p in store.pars])
+        return df.rename(columns=lambda c: c[len(PAR_PREFIX):] if c.startswith(PAR_PREFIX) else c), store.pars
+    if os.path.exists(tdir + '/extended'):
+        dfs = []
+        for fname in os.listdir(tdir + '/extended'):
+            pars = {k: float(v) for k, v in (p.split('=') for p in fname[:-4].split('-')[1:])}
+            df = read_trades(tdir + '/extended/' + fname, usecols=STATS_COLUMNS)
+            if not df.empty: dfs.append(df.assign(**pars))  # an empty one would make every column object
+        return pd.concat(dfs, ignore_index=True), list(pars.keys())
+    try:
+        from stats.extender import GRID, FIXED_COLS, extend
+    except ImportError:  # run as a script from stats/, where `stats` is stats/stats.py
+        from extender import GRID, FIXED_COLS, extend
+    edfs = [edf for fname in os.listdir(tdir + '/raw') for edf in extend(pd.read_csv(tdir + '/raw/' + fname), GRID, FIXED_COLS, trade_on_open=True, trim_pnl='sl/tp')]
+    edfs = [edf for edf in edfs if not edf['df'].empty]
+    return pd.concat([edf['df'][STATS_COLUMNS].assign(**edf['pars']) for edf in edfs], ignore_index=True), list(edfs[0]['pars'].keys())
+
+def get_windows(start: pd.Timestamp, end: pd.Timestamp, train: pd.DateOffset = TRAIN, test: pd.DateOffset = TEST) -> list[tuple]:
+    # (train start, test start, test end), the last test window may be partial
+    windows = []
+    t, stop = start.normalize(), end.normalize() + pd.Timedelta(days=1)
+    while t + train < stop:
+        windows.append((t, t + train, min(t + train + test, stop)))
+        t += test
+    return windows
+
+def fingerprint(df: pd.DataFrame) -> str:
+    # order-independent, so the same trades read in another order hit the cache
+    rows = pd.util.hash_pandas_object(df, index=False).values
+    return hashlib.sha1(np.array([rows.sum(), len(rows)], dtype=np.uint64).tobytes()).hexdigest()[:16]
+
+def get_window_stats(df: pd.DataFrame, pars: list[str], start: pd.Timestamp, end: pd.Timestamp, cache_dir: str = None) -> pd.DataFrame:
+    # every combination scored on the trades entered in [start, end)
+    window = df[(df['EntryTime'] >= start) & (df['EntryTime'] < end)]
+    if cache_dir is None:
+        return get_stats_batch(window, pars)
+    path = f'{cache_dir}/{start:%Y%m%d}-{end:%Y%m%d}-{fingerprint(window)}.csv'
+    if os.path.exists(path):
+        return pd.read_csv(path)
+    stats = get_stats_batch(window, pars)
+    os.makedirs(cache_dir, exist_ok=True)
+    stats.to_csv(path, index=False)
+    return stats
+
+def walk_forward(df: pd.DataFrame, pars: list[str], metric: str = METRIC, min_trades: int = MIN_TRADES, train: pd.DateOffset = TRAIN, test: pd.DateOffset = TEST, cache_dir: str = None) -> tuple[pd.DataFrame, pd.DataFrame]:
+    '''
+    returns a row per window (the combination picked, its train and test stats) and the out of sample trades
+    (the picked combination's trades of each test window, PnL capped like get_stats does, with the equity curve EC)
+    '''
+    df = df.assign(EntryTime=pd.to_datetime(df['EntryTime']), ExitTime=pd.to_datetime(df['ExitTime']))
+    rows, oos = [], []
+    for train_start, test_start, test_end in get_windows(df['EntryTime'].min(), df['EntryTime'].max(), train, test):
+        train_stats = get_window_stats(df, pars, train_start, test_start, cache_dir)
+        candidates = train_stats[train_stats['total_trades'] >= min_trades].dropna(subset=[metric])
+        row = {'train_start': train_start, 'test_start': test_start, 'test_end': test_end}
+        if candidates.empty:
+            rows.append(row)
+            continue
+        best = candidates.sort_values(metric, ascending=False, kind='stable').iloc[0]
+        picked = {p: best[p] for p in pars}
+        test_stats = get_window_stats(df, pars, test_start, test_end, cache_dir)
+        match = np.logical_and.reduce([np.isclose(test_stats[p], v) for p, v in picked.items()]) if not test_stats.empty else []
+        tested = test_stats[match].iloc[0] if np.any(match) else pd.Series(dtype=np.float64)
+        rows.append({
+            **row, **picked,
+            **{f'train_{k}': best[k] for k in ['total_trades', 'PnL', metric]},
+            **{f'test_{k}': tested.get(k, np.nan) for k in ['total_trades', 'PnL', 'max_drawdown', metric]},
+        })
+
+        mask = (df['EntryTime'] >= test_start) & (df['EntryTime'] < test_end)
+        for p, v in picked.items():
+            mask &= np.isclose(df[p].values, v)
+        trades = df[mask].copy()
+        if 'sl_prc' in picked:
+            trades['PnL'] = strip_pnl_series(trades['PnL'], picked['sl_prc'], picked['reward'])
+        oos.append(trades)
+
+    oos = pd.concat(oos, ignore_index=True) if oos else pd.DataFrame(columns=df.columns)
+    oos = oos.sort_values('ExitTime', kind='stable').reset_index(drop=True)
+    oos['EC'] = oos['PnL'].cumsum()
+    return pd.DataFrame(rows), oos
+
+
+if __name__ == '__main__':
+    df, pars = read_extended(tdir)
+    windows, oos = walk_forward(df, pars, cache_dir=tdir + '/walkforward')
+    windows.to_csv(tdir + '/walkforward.csv', index=False)
+    oos.to_csv(tdir + '/walkforward_trades.csv', index=False)
+    print(windows.to_string())
+    if len(oos) > 1:
+        # the stitched curve scored like any combination (PnL already capped per window)
+        print(pd.Series(get_stats_df(oos[STATS_COLUMNS].copy(), {})).to_string())
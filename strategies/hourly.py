@@ -0,0 +1,213 @@
+"""
+Array version of SimplePump (the 1h one). Same trades (and strategy.schema() columns) as run.backtest_df
+(Backtest with trade_on_close=True), without stepping backtesting.py through every hourly bar.
+
+The day high/low/volume that next() carries across bars, RVOL and the 15:00 signal are computed for the whole symbol
+with cumulative ops, once for the entire grid. The entry bar of every trigger for every entry_hour is a searchsorted.
+What's left per combination is a loop over its trades: idle stretches are skipped, and only the bars where an order is
+in flight or a trade is open (sl/tp, 5-day time exit) are stepped through.
+
+What it doesn't model: the broker cancelling orders once a symbol burns through its 10000 cash.
+"""
+import numpy as np
+import pandas as pd
+from backtesting import Strategy
+
+from utils import TRADE_COLUMNS, compact
+from .momopump import SimplePump
+
+# SimplePump has no pars(), these are its class attributes
+PARS = ['pullback', 'rvol', 'day_net_change', 'entry_hour', 'sl_prc', 'reward']
+
+def get_features(df: pd.DataFrame, strategy: Strategy) -> dict:
+    '''
+    df - one symbol, as run.load_df returns it
+    '''
+    n = df.shape[0]
+    adv = (df['adv'].values if 'adv' in df.columns else strategy.precompute(df)['adv']).astype(np.float64)
+    # backtesting.py starts calling next() one bar after every indicator has warmed up
+    start = 1 + (np.isnan(adv).argmin() if n else 0)
+    o, h, l, c, v = (df[col].values.astype(np.float64) for col in ['Open', 'High', 'Low', 'Close', 'Volume'])
+    hour = df.index.hour.values
+    date = df.index.values.astype('datetime64[D]')
+    idx = np.arange(n)
+    new_day = np.r_[False, df.index.day.values[1:] != df.index.day.values[:-1]]  # dt[-1].day != dt[-2].day
+
+    # the day's high/low/volume as next() has them after bar i: reset on a new day, carried over otherwise.
+    # bars before the first reset after `start` carry init()'s High[0]/Low[0] instead
+    day_high, day_low, day_volume = np.full(n, np.nan), np.full(n, np.nan), np.full(n, np.nan)
+    if start < n:
+        seg = np.cumsum(new_day[start:] | (idx[start:] == start))
+        by = lambda x: pd.Series(x[start:]).groupby(seg)
+        day_high[start:] = by(h).cummax().values
+        day_low[start:] = by(l).cummin().values
+        day_volume[start:] = by(v).cumsum().values
+        if not new_day[start]:
+            first = seg == 1
+            day_high[start:][first] = np.maximum(day_high[start:][first], h[0])
+            day_low[start:][first] = np.minimum(day_low[start:][first], l[0])
+
+    # signals are only evaluated on the 15:00 bars, each against the close of the previous one
+    signal_bar = (hour == 15) & (idx >= start)
+    at = np.flatnonzero(signal_bar)
+    prev_day_close = np.r_[c[0], c[at][:-1]] if n else c[at]
+    day_net_change, rvol, pullback = np.full(n, np.nan), np.full(n, np.nan), np.full(n, np.nan)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        day_net_change[at] = (day_high[at] - prev_day_close) / prev_day_close
+        rvol[at] = day_volume[at] / adv[at]
+        pullback[at] = (day_high[at] - c[at]) / (day_high[at] - day_low[at])
+
+    return {
+        'symbol': df.attrs.get('symbol'),
+        'time': df.index.values,
+        'open': o, 'high': h, 'low': l, 'close': c,
+        'hour': hour, 'date': date, 'new_day': new_day,
+        'signal_bar': signal_bar,
+        'day_net_change': day_net_change, 'rvol': rvol, 'pullback': pullback,
+        'next_date': np.searchsorted(date, date, side='right'),  # first bar of a later date
+        'entry_bars': {},
+    }
+
+def get_entry_bars(f: dict, entry_hour: int) -> np.ndarray:
+    # for every bar, the first bar of a later date at or after entry_hour (len = none), shared by all the pars with that entry_hour
+    if entry_hour not in f['entry_bars']:
+        eligible = np.flatnonzero(f['hour'] >= entry_hour)
+        pos = np.searchsorted(eligible, f['next_date'])
+        f['entry_bars'][entry_hour] = np.r_[eligible, len(f['hour'])][pos]
+    return f['entry_bars'][entry_hour]
+
+def get_signal(f: dict, pars: dict) -> np.ndarray:
+    # the 15:00 condition, before the position check
+    with np.errstate(invalid='ignore'):
+        return f['signal_bar'] & (f['rvol'] > pars['rvol']) & (f['day_net_change'] > pars['day_net_change']) & (f['pullback'] < pars['pullback'])
+
+def simulate(f: dict, pars: dict) -> list[tuple]:
+    o, h, l, c, date = f['open'], f['high'], f['low'], f['close'], f['date']
+    n = len(c)
+    signal = get_signal(f, pars)
+    candidates = np.flatnonzero(signal)
+    entry_hour = pars['entry_hour']
+    entry_bars = get_entry_bars(f, entry_hour)
+
+    def order(i, tag):
+        # SimplePump.buy_fixed at close[i]; Strategy.buy would assert on a 0 size
+        price = c[i]
+        size = round(1000 / price)
+        if size == 0: return None
+        return {'size': size, 'tp': round(price * (1 + pars['sl_prc'] * pars['reward']), 3), 'sl': round(price * (1 - pars['sl_prc']), 3), 'tag': tag}
+
+    closed = []
+    def close(trade, price, bar):
+        closed.append((trade, price, bar))
+
+    def sl_hit(trade, i):
+        if trade['sl'] and l[i] <= trade['sl']:
+            close(trade, min(o[i], trade['sl']), i)  # at the open if it gapped through
+            return True
+        return False
+
+    def tp_hit(trade, i):
+        if h[i] >= trade['tp']:
+            close(trade, max(o[i], trade['tp']), i)
+            return True
+        return False
+
+    def sltp(trades, i):
+        # the broker queues every sl in front (newest first) and every tp at the back
+        hit = {id(t) for t in reversed(trades) if sl_hit(t, i)}
+        hit |= {id(t) for t in trades if id(t) not in hit and tp_hit(t, i)}
+        return [t for t in trades if id(t) not in hit]
+
+    trades, pending, placed, closing = [], None, None, False
+    k, ci = 0, 0
+    while True:
+        if not trades and placed is None and not closing:
+            # nothing in flight: jump to the next signal, or to the pending entry if it comes first
+            while ci < len(candidates) and candidates[ci] < k:
+                ci += 1
+            nxt = candidates[ci] if ci < len(candidates) else n
+            if pending is not None:
+                nxt = min(nxt, max(entry_bars[pending[0]], k))
+            k = max(k, nxt)
+        if k >= n: break
+
+        # broker.next(): close orders, sl/tp of the open trades, then the new entry (filled at the previous close) and its sl/tp
+        if closing:
+            for trade in reversed(trades):
+                close(trade, c[k-1], k-1)
+            trades, closing = [], False
+        trades = sltp(trades, k)
+        if placed is not None:
+            trades += sltp([{**placed, 'entry_bar': k-1, 'entry_price': c[k-1]}], k)
+            placed = None
+
+        # strategy.next()
+        if f['new_day'][k] and trades and (date[k] - date[trades[-1]['entry_bar']]) >= np.timedelta64(5, 'D'):
+            closing = True
+        if pending is not None and k >= entry_bars[pending[0]]:
+            placed = order(k, pending[1])
+            pending = None
+        if signal[k] and not trades:
+            tag = {
+                'pullback': float(f['pullback'][k]), 'rvol': float(f['rvol'][k]), 'day_net_change': float(f['day_net_change'][k]),
+                'entry_hour': entry_hour, 'sl_prc': pars['sl_prc'], 'reward': pars['reward'],
+            }
+            if entry_hour == 15:
+                placed = order(k, tag)
+            else:
+                pending = (k, tag)
+        k += 1
+
+    return closed
+
+def backtest_hourly(df: pd.DataFrame, strategy: Strategy, strategy_pars: dict, features: dict = None) -> pd.DataFrame:
+    if strategy is not SimplePump:
+        raise ValueError(f'{strategy.__name__} has no hourly engine')
+    pars = {**{k: getattr(strategy, k) for k in PARS}, **strategy_pars}
+    f = features if features is not None else get_features(df, strategy)
+    closed = simulate(f, pars)
+    schema = strategy.schema()
+
+    entry = np.array([t['entry_bar'] for t, _, _ in closed], dtype=np.int64)
+    exit_bar = np.array([bar for _, _, bar in closed], dtype=np.int64)
+    size = np.array([t['size'] for t, _, _ in closed], dtype=np.int64)
+    entry_price = np.array([t['entry_price'] for t, _, _ in closed], dtype=np.float64)
+    exit_price = np.array([price for _, price, _ in closed], dtype=np.float64)
+    trades = pd.DataFrame({
+        'Symbol': f['symbol'],
+        'Size': size,
+        'EntryBar': entry,
+        'ExitBar': exit_bar,
+        'EntryPrice': entry_price,
+        'ExitPrice': exit_price,
+        'SL': np.array([t['sl'] or np.nan for t, _, _ in closed], dtype=np.float64),
+        'TP': np.array([t['tp'] for t, _, _ in closed], dtype=np.float64),
+        'PnL': size * (exit_price - entry_price),
+        'ReturnPct': exit_price / entry_price - 1,
+        'EntryTime': f['time'][entry],
+        'ExitTime': f['time'][exit_bar],
+    })
+    trades['Duration'] = trades['ExitTime'] - trades['EntryTime']
+    for k in schema.keys():
+        trades[k] = [t['tag'][k] for t, _, _ in closed]
+    return compact(trades[TRADE_COLUMNS + list(schema.keys())].astype(schema))
+
+def backtest_grid(panel: pd.DataFrame, strategy: Strategy, combs: list[dict]):
+    # features (and the entry bars of each entry_hour) don't depend on the rest of the pars, so they're computed once per symbol
+    # panel - cache.get_panel of the symbols
+    dfs = []
+    for _, g in panel.groupby(panel['symbol'].ne(panel['symbol'].shift()).cumsum().values, sort=False):
+        df = g.drop(columns=['symbol'])
+        df.attrs['symbol'] = g['symbol'].iloc[0]
+        dfs.append(df)
+    features = [get_features(df, strategy) for df in dfs]
+    for pars in combs:
+        # concat makes the per symbol categoricals text again
+        yield pars, compact(pd.concat([backtest_hourly(df, strategy, pars, f) for df, f in zip(dfs, features)], ignore_index=True))
+
+
+if __name__ == '__main__':
+    from .parity import main
+
+    # python -m strategies.hourly data/ohlcv-1h/backtrader [n_symbols]
+    main(backtest_hourly, [SimplePump], {'sl_prc': [0.1, 0.3], 'reward': [1, 3], 'entry_hour': [15, 4, 8], 'pullback': [0.6], 'rvol': [3], 'day_net_change': [0.2]})
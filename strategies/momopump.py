@@ -10,6 +10,16 @@ def SMA(values, n):
     """
     return pd.Series(values).rolling(n).mean()
 
+def precomputed(strategy: Strategy, name: str):
+    """
+    Indicator `name` from strategy.precompute(). Taken straight from the data
+    if the runner already added it as a column (run.backtest_symbol_grid does it
+    once per symbol, since these don't depend on the swept params).
+    """
+    df = strategy.data.df
+    values = df[name].values if name in df.columns else strategy.precompute(df)[name]
+    return strategy.I(lambda: values, name=name)
+
 FIBO = {
     0: 0,
     1: 0.236,
@@ -37,8 +47,7 @@ class SimplePump(Strategy):
     reward = 2
 
     def init(self):
-        daily_volume = backtesting.lib.resample_apply('1D', lambda x: x, self.data.Volume, agg='sum')
-        self.adv = self.I(SMA, daily_volume, 16*14)
+        self.adv = precomputed(self, 'adv')
 
         self.prev_day_close = self.data.Close[0]
         self.day_high = self.data.High[0]
@@ -90,6 +99,17 @@ class SimplePump(Strategy):
         
         self.prev_day_close = close[-1]
 
+    @classmethod
+    def precompute(cls, df: pd.DataFrame) -> dict:
+        # indicators that don't depend on the params
+        daily_volume = backtesting.lib.resample_apply('1D', lambda x: x, df['Volume'], agg='sum')
+        return {'adv': SMA(daily_volume, 16*14).values}
+
+    @classmethod
+    def schema(cls):
+        # tag keys (in the order next() writes them) and their dtypes; run.get_trades writes them as trade columns
+        return {'pullback': 'float64', 'rvol': 'float64', 'day_net_change': 'float64', 'entry_hour': 'int64', 'sl_prc': 'float64', 'reward': 'float64'}
+
     def buy_fixed(self, price, tag, bp=1000):
         self.buy(
             size=round(bp/price),
@@ -112,7 +132,7 @@ class SimplePumpDaily_Fibo(Strategy):
     fibo = 0 # 0 = 0, 1 = 0.236, 2 = 0.382, 3 = 0.5, 4 = 0.618, 5 = 0.786
 
     def init(self):
-        self.adv = self.I(SMA, self.data.Volume, 14)
+        self.adv = precomputed(self, 'adv')
 
         self.status = {
             'waiting_for_entry': False,
@@ -153,11 +173,21 @@ class SimplePumpDaily_Fibo(Strategy):
             }
             self.buy(size=round(1000/close[-1]), tag=self.status['tag'])  # it's fine to modify self.status['tag'] until you close this position
 
+    @classmethod
+    def precompute(cls, df: pd.DataFrame) -> dict:
+        # indicators that don't depend on the params
+        return {'adv': SMA(df['Volume'], 14).values}
+
     @classmethod
     def pars(cls):
         # the order actually matters, cause in this order params are written for the filename
         return ['day_net_change', 'rvol', 'pullback', 'sl_prc', 'reward', 'fibo']
 
+    @classmethod
+    def schema(cls):
+        # tag keys (in the order next() writes them) and their dtypes; run.get_trades writes them as trade columns
+        return {'pullback': 'float64', 'rvol': 'float64', 'day_net_change': 'float64', 'sl_prc': 'float64', 'reward': 'float64', 'fibo': 'int64', 'tp': 'float64', 'sl': 'float64', 'exit': 'float64', 'exit_reason': 'str'}
+
 
 class SimplePumpDaily_CC(Strategy):
 
@@ -170,7 +200,7 @@ class SimplePumpDaily_CC(Strategy):
     day_net_change = 0.3
 
     def init(self):
-        self.adv = self.I(SMA, self.data.Volume, 14)
+        self.adv = precomputed(self, 'adv')
 
         self.status = {
             'waiting_for_entry': False,
@@ -193,11 +223,21 @@ class SimplePumpDaily_CC(Strategy):
             }
             self.buy(size=round(1000/close[-1]), tag=self.status['tag'])
 
+    @classmethod
+    def precompute(cls, df: pd.DataFrame) -> dict:
+        # indicators that don't depend on the params
+        return {'adv': SMA(df['Volume'], 14).values}
+
     @classmethod
     def pars(cls):
         # the order actually matters, cause in this order params are written for the filename
         return ['day_net_change', 'rvol', 'pullback']
 
+    @classmethod
+    def schema(cls):
+        # tag keys (in the order next() writes them) and their dtypes; run.get_trades writes them as trade columns
+        return {'pullback': 'float64', 'rvol': 'float64', 'day_net_change': 'float64'}
+
 class SimplePumpDaily_CCPRC(Strategy):
 
     """
@@ -211,7 +251,7 @@ class SimplePumpDaily_CCPRC(Strategy):
     reward = 2
 
     def init(self):
-        self.adv = self.I(SMA, self.data.Volume, 14)
+        self.adv = precomputed(self, 'adv')
 
         self.status = {
             'waiting_for_entry': False,
@@ -242,11 +282,21 @@ class SimplePumpDaily_CCPRC(Strategy):
             }
             self.buy(size=round(1000/close[-1]), tp=tp, sl=sl, tag=self.status['tag'])
 
+    @classmethod
+    def precompute(cls, df: pd.DataFrame) -> dict:
+        # indicators that don't depend on the params
+        return {'adv': SMA(df['Volume'], 14).values}
+
     @classmethod
     def pars(cls):
         # the order actually matters, cause in this order params are written for the filename
         return ['day_net_change', 'rvol', 'pullback', 'sl_prc', 'reward']
 
+    @classmethod
+    def schema(cls):
+        # tag keys (in the order next() writes them) and their dtypes; run.get_trades writes them as trade columns
+        return {'pullback': 'float64', 'rvol': 'float64', 'day_net_change': 'float64', 'sl_prc': 'float64', 'reward': 'float64', 'tp': 'float64', 'sl': 'float64', 'exit_reason': 'str'}
+
 class SimplePumpDaily_OC(Strategy):
     # !!! trade_on_close = False !!!
 
@@ -259,7 +309,7 @@ class SimplePumpDaily_OC(Strategy):
     day_net_change = 0.3
 
     def init(self):
-        self.adv = self.I(SMA, self.data.Volume, 14)
+        self.adv = precomputed(self, 'adv')
 
         self.status = {
             'waiting_for_entry': False,
@@ -283,11 +333,21 @@ class SimplePumpDaily_OC(Strategy):
             }
             self.buy(size=round(1000/close[-1]), tag=self.status['tag'])
 
+    @classmethod
+    def precompute(cls, df: pd.DataFrame) -> dict:
+        # indicators that don't depend on the params
+        return {'adv': SMA(df['Volume'], 14).values}
+
     @classmethod
     def pars(cls):
         # the order actually matters, cause in this order params are written for the filename
         return ['day_net_change', 'rvol', 'pullback']
 
+    @classmethod
+    def schema(cls):
+        # tag keys (in the order next() writes them) and their dtypes; run.get_trades writes them as trade columns
+        return {'pullback': 'float64', 'rvol': 'float64', 'day_net_change': 'float64', 'exit': 'float64'}
+
 class SimplePumpDaily_OCPRC(Strategy):
     # !!! trade_on_close = False !!!
 
@@ -302,7 +362,7 @@ class SimplePumpDaily_OCPRC(Strategy):
     reward = 2
 
     def init(self):
-        self.adv = self.I(SMA, self.data.Volume, 14)
+        self.adv = precomputed(self, 'adv')
 
         self.status = {
             'waiting_for_entry': False,
@@ -342,7 +402,17 @@ class SimplePumpDaily_OCPRC(Strategy):
             }
             self.buy(size=round(1000/close[-1]), tag=self.status['tag'])
 
+    @classmethod
+    def precompute(cls, df: pd.DataFrame) -> dict:
+        # indicators that don't depend on the params
+        return {'adv': SMA(df['Volume'], 14).values}
+
     @classmethod
     def pars(cls):
         # the order actually matters, cause in this order params are written for the filename
-        return ['day_net_change', 'rvol', 'pullback', 'sl_prc', 'reward']
\ No newline at end of file
+        return ['day_net_change', 'rvol', 'pullback', 'sl_prc', 'reward']
+
+    @classmethod
+    def schema(cls):
+        # tag keys (in the order next() writes them) and their dtypes; run.get_trades writes them as trade columns
+        return {'pullback': 'float64', 'rvol': 'float64', 'day_net_change': 'float64', 'sl_prc': 'float64', 'reward': 'float64', 'tp': 'float64', 'sl': 'float64', 'exit_reason': 'str', 'exit': 'float64'}
\ No newline at end of file
@@ -0,0 +1,61 @@
+"""
+Checks an array engine (strategies.vectorized, strategies.hourly) against run.backtest_df, the reference:
+the same trades, symbol by symbol and combination by combination.
+"""
+import numpy as np
+import pandas as pd
+from itertools import product
+from typing import Callable
+from backtesting import Strategy
+
+
+def parity(df: pd.DataFrame, strategy: Strategy, strategy_pars: dict, engine: Callable) -> pd.DataFrame:
+    '''
+    Runs one symbol through run.backtest_df and through engine(df, strategy, strategy_pars), returns the trades that don't match
+    (as an outer merge on EntryBar, so a missing trade shows up too). Empty frame = parity.
+    '''
+    from run import backtest_df
+    expected = backtest_df({'df': df, 'strategy_pars': strategy_pars, 'strategy': strategy})
+    actual = engine(df, strategy, strategy_pars)
+    merged = expected.merge(actual, on='EntryBar', how='outer', suffixes=('', '_vec'), indicator=True)
+    same = merged['_merge'] == 'both'
+    for col in [c for c in expected.columns if c not in ('Symbol', 'EntryBar')]:
+        a, b = merged[col], merged[col + '_vec']
+        if pd.api.types.is_float_dtype(a) and pd.api.types.is_float_dtype(b):
+            same &= np.isclose(a, b, rtol=1e-12, atol=0) | (a.isna() & b.isna())
+        else:
+            # categoricals (e.g. exit_reason) with other categories can't be compared, their values can
+            a, b = (x.astype(object) if isinstance(x.dtype, pd.CategoricalDtype) else x for x in (a, b))
+            same &= (a == b).fillna(False)
+    return merged[~same]
+
+def mismatches(dfs: list[pd.DataFrame], strategy: Strategy, grid: dict, engine: Callable) -> list[tuple[str, dict, pd.DataFrame]]:
+    # parity() of every symbol with every combination of the grid's pars the strategy has, (symbol, pars, diff) of the ones off
+    keys = [k for k in grid.keys() if hasattr(strategy, k)]
+    combs = [dict(zip(keys, pars)) for pars in product(*[grid[k] for k in keys])]
+    found = []
+    for df in dfs:
+        for pars in combs:
+            diff = parity(df, strategy, pars, engine)
+            if not diff.empty:
+                found.append((df.attrs['symbol'], pars, diff))
+    return found
+
+def main(engine: Callable, strategies: list[Strategy], grid: dict):
+    # python -m strategies.{vectorized,hourly} data/ohlcv-{1d,1h}/backtrader [n_symbols]
+    import os
+    import sys
+    import warnings
+    from tqdm import tqdm
+    from run import load_df
+    warnings.filterwarnings('ignore')
+
+    data_dir = sys.argv[1]
+    files = sorted(os.listdir(data_dir))[:int(sys.argv[2]) if len(sys.argv) > 2 else None]
+    found = 0
+    for strategy in strategies:
+        for fn in tqdm(files, desc=strategy.__name__):
+            for symbol, pars, diff in mismatches([load_df(data_dir + '/' + fn)], strategy, grid, engine):
+                found += 1
+                print(strategy.__name__, symbol, pars, '\n', diff)
+    print('mismatches:', found)
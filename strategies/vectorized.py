@@ -0,0 +1,163 @@
+"""
+Array version of the SimplePumpDaily_* family. Same trades (and strategy.schema() columns) as run.backtest_df (Backtest with trade_on_close=True),
+but the features and the entry/exit bars for a whole symbol, or a panel of symbols stacked one after another,
+are computed in one go instead of bar by bar.
+
+What it doesn't model: the broker cancelling orders once a symbol burns through its 10000 cash.
+"""
+import numpy as np
+import pandas as pd
+from backtesting import Strategy
+
+from cache import get_panel
+from utils import TRADE_COLUMNS, compact
+from .momopump import FIBO, SimplePumpDaily_Fibo, SimplePumpDaily_CC, SimplePumpDaily_CCPRC, SimplePumpDaily_OC, SimplePumpDaily_OCPRC
+
+
+DAILY = (SimplePumpDaily_Fibo, SimplePumpDaily_CC, SimplePumpDaily_CCPRC, SimplePumpDaily_OC, SimplePumpDaily_OCPRC)
+
+
+def get_features(panel: pd.DataFrame, strategy: Strategy) -> dict[str, np.ndarray]:
+    '''
+    panel - one or more run.load_df frames stacked by cache.get_panel (each symbol sorted by time), or a single run.load_df frame
+    '''
+    if 'symbol' not in panel.columns:
+        panel = get_panel([panel])
+    new_symbol = panel['symbol'].ne(panel['symbol'].shift()).values
+    group = np.cumsum(new_symbol) - 1
+    starts = np.flatnonzero(new_symbol)
+    ends = np.r_[starts[1:], len(panel)]
+    bar = np.arange(len(panel)) - starts[group]
+
+    if 'adv' in panel.columns:
+        adv = panel['adv'].values
+    else:
+        adv = np.concatenate([strategy.precompute(g)['adv'] for _, g in panel.groupby(group, sort=False)])
+
+    # backtesting.py starts calling next() one bar after every indicator has warmed up
+    warmup = np.minimum.reduceat(np.where(np.isnan(adv), len(panel), bar), starts)
+    warmup[warmup == len(panel)] = 0
+
+    o, h, l, c, v = (panel[col].values.astype(np.float64) for col in ['Open', 'High', 'Low', 'Close', 'Volume'])
+    prev_close = np.r_[np.nan, c[:-1]]
+    prev_close[starts] = np.nan
+    with np.errstate(divide='ignore', invalid='ignore'):
+        day_net_change = (h - prev_close) / prev_close
+        rvol = v / adv
+        pullback = (h - c) / (h - l)
+
+    return {
+        'symbol': panel['symbol'].values,
+        'time': panel.index.values,
+        'open': o, 'high': h, 'low': l, 'close': c,
+        'day_net_change': day_net_change,
+        'rvol': rvol,
+        'pullback': pullback,
+        'bar': bar,
+        'end': ends[group],  # first row of the next symbol
+        'new_symbol': new_symbol,
+        'tradable': bar >= 1 + warmup[group],
+    }
+
+def get_entries(f: dict, pars: dict) -> np.ndarray:
+    with np.errstate(invalid='ignore'):
+        return f['tradable'] & (f['rvol'] > pars['rvol']) & (f['day_net_change'] > pars['day_net_change']) & (f['pullback'] < pars['pullback'])
+
+def take_entries(signal: np.ndarray, released: np.ndarray, new_symbol: np.ndarray) -> np.ndarray:
+    '''
+    Positions are held one bar, so an entry blocks the next bar unless released (sl/tp filled on that bar).
+    Resolved by iterating to the fixed point, which takes as many rounds as the longest run of consecutive signals.
+    '''
+    taken = signal
+    while True:
+        blocked = np.r_[False, taken[:-1] & ~released[:-1]] & ~new_symbol
+        new = signal & ~blocked
+        if (new == taken).all():
+            return taken
+        taken = new
+
+def backtest_vectorized(panel: pd.DataFrame, strategy: Strategy, strategy_pars: dict, features: dict = None) -> pd.DataFrame:
+    if strategy not in DAILY:
+        raise ValueError(f'{strategy.__name__} has no vectorized version')
+    pars = {**{k: getattr(strategy, k) for k in strategy.pars()}, **strategy_pars}
+    f = features if features is not None else get_features(panel, strategy)
+    n = len(f['close'])
+    c = f['close']
+    nxt = lambda x: np.r_[x[1:], np.nan]
+    next_open, next_high, next_low, next_close = nxt(f['open']), nxt(f['high']), nxt(f['low']), nxt(c)
+
+    cols = {}
+    with np.errstate(invalid='ignore'):
+        if 'sl_prc' in pars:
+            cols['sl_prc'] = np.full(n, pars['sl_prc'])
+            cols['reward'] = np.full(n, pars['reward'])
+            cols['tp'] = np.round(c * (1 + pars['sl_prc']*pars['reward']), 3)
+        if strategy is SimplePumpDaily_Fibo:
+            cols['fibo'] = np.full(n, pars['fibo'])
+            rng = f['high'] - f['low']
+            cols['sl'] = np.round(rng * FIBO[pars['fibo']] + f['low'], 3)
+            if pars['fibo'] > 0:
+                cols['sl'] = np.where(cols['sl'] >= c, np.round(rng * FIBO[pars['fibo']-1] + f['low'], 3), cols['sl'])
+        elif 'sl_prc' in pars:
+            cols['sl'] = np.round(c * (1 - pars['sl_prc']), 3)
+
+        released = np.zeros(n, dtype=bool)
+        exit_price = next_close
+        if strategy is SimplePumpDaily_CCPRC:
+            # real sl/tp orders: filled by the broker on the next bar, sl first, at the open if it gapped through
+            sl_hit = next_low <= cols['sl']
+            tp_hit = ~sl_hit & (next_high >= cols['tp'])
+            released = sl_hit | tp_hit
+            exit_price = np.where(sl_hit, np.minimum(next_open, cols['sl']), np.where(tp_hit, np.maximum(next_open, cols['tp']), next_close))
+            cols['exit_reason'] = np.where(released, 'sltp', 'close')
+        elif 'sl' in cols:
+            # sl/tp are only written to the tag, the position is closed on the next close anyway
+            sl_hit = next_low <= cols['sl']
+            tp_hit = ~sl_hit & (next_high >= cols['tp'])
+            cols['exit'] = np.where(sl_hit, cols['sl'], np.where(tp_hit, cols['tp'], next_close))
+            cols['exit_reason'] = np.where(sl_hit, 'sl', np.where(tp_hit, 'tp', 'close'))
+        else:
+            cols['exit'] = next_close
+
+    taken = take_entries(get_entries(f, pars), released, f['new_symbol'])
+    # the exit order placed on the next bar is only filled on the one after it, sl/tp fill right on the next bar
+    idx = np.arange(n)
+    recorded = taken & ((idx + 2 < f['end']) | (released & (idx + 1 < f['end'])))
+    i = np.flatnonzero(recorded)
+    size = np.round(1000 / c[i]).astype(np.int64)
+    i, size = i[size > 0], size[size > 0]  # Strategy.buy asserts on these
+    j = i + 1
+
+    trades = pd.DataFrame({
+        'Symbol': f['symbol'][i],
+        'Size': size,
+        'EntryBar': f['bar'][i],
+        'ExitBar': f['bar'][j],
+        'EntryPrice': c[i],
+        'ExitPrice': exit_price[i],
+        'SL': cols['sl'][i] if strategy is SimplePumpDaily_CCPRC else np.nan,
+        'TP': cols['tp'][i] if strategy is SimplePumpDaily_CCPRC else np.nan,
+        'PnL': size * (exit_price[i] - c[i]),
+        'ReturnPct': exit_price[i] / c[i] - 1,
+        'EntryTime': f['time'][i],
+        'ExitTime': f['time'][j],
+    })
+    trades['Duration'] = trades['ExitTime'] - trades['EntryTime']
+    tag_cols = {'pullback': f['pullback'], 'rvol': f['rvol'], 'day_net_change': f['day_net_change'], **cols}
+    schema = strategy.schema()
+    for k in schema.keys():
+        trades[k] = tag_cols[k][i]
+    return compact(trades[TRADE_COLUMNS + list(schema.keys())].astype(schema))
+
+def backtest_grid(panel: pd.DataFrame, strategy: Strategy, combs: list[dict]):
+    # features don't depend on the pars, so they're computed once for the whole grid
+    features = get_features(panel, strategy)
+    for pars in combs:
+        yield pars, backtest_vectorized(panel, strategy, pars, features)
+
+
+if __name__ == '__main__':
+    from .parity import main
+
+    # python -m strategies.vectorized data/ohlcv-1d/backtrader [n_symbols]
+    main(backtest_vectorized, DAILY, {'sl_prc': [0.1, 0.3], 'reward': [1, 3], 'fibo': [0, 3], 'pullback': [0.6], 'rvol': [3], 'day_net_change': [0.2]})
@@ -0,0 +1,8 @@
+import os
+import sys
+import warnings
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path: sys.path.insert(0, ROOT)  # root modules (run, bench, ...) and the stats/strategies packages
+
+warnings.filterwarnings('ignore')  # backtesting's and the strategies' own, on the synthetic data
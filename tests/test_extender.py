@@ -0,0 +1,36 @@
+'''
+stats/extender.py main() on a raw file too big to load (extend_file_chunked/get_stats_chunked) gives the stats of the
+in-memory path.
+'''
+import pandas as pd
+
+from bench import synthetic
+from stats import extender
+from stats.extender import GRID, FIXED_COLS, extend, get_extended_stats
+from strategies.momopump import SimplePumpDaily_Fibo
+from strategies.vectorized import backtest_vectorized
+
+PARS = {'sl_prc': 0.1, 'reward': 2, 'fibo': 0, 'pullback': 0.6, 'rvol': 3, 'day_net_change': 0.2}
+
+
+def test_big_raw(tmp_path, monkeypatch):
+    raw = pd.concat([backtest_vectorized(df, SimplePumpDaily_Fibo, PARS) for df in synthetic(10, 600, '1d', seed=3)], ignore_index=True)
+    (tmp_path / 'raw').mkdir()
+    raw.to_csv(tmp_path / 'raw' / 'trades-sl_prc=0.1-reward=2.csv', index=False)
+    monkeypatch.setattr(extender, 'tdir', str(tmp_path))
+    monkeypatch.setattr(extender, 'STREAM_ABOVE', 1000)
+    monkeypatch.setattr(extender, 'FUSED', True)
+    monkeypatch.setattr(extender, 'MC_RESAMPLES', 0)
+    monkeypatch.setattr('stats.stats.STREAM_ABOVE', 1000)
+    monkeypatch.setattr('stats.stats.MC_RESAMPLES', 0)
+    extender.main()
+
+    edfs = extend(extender.read_trades(str(tmp_path / 'raw' / 'trades-sl_prc=0.1-reward=2.csv')), GRID, FIXED_COLS, trade_on_open=True, trim_pnl='sl/tp')
+    assert any(edf['df'].empty for edf in edfs)  # cells without trades, written as header-only files
+    key = lambda row: tuple(float(row[k]) for k in list(GRID) + FIXED_COLS)
+    expected = {key(row): row for row in get_extended_stats(edfs)}
+    actual = {key(row): row for row in pd.read_csv(tmp_path / 'stats.csv').to_dict('records')}
+    assert expected.keys() == actual.keys()
+    for k, row in expected.items():
+        for col in ['PnL', 'NetPnL', 'total_trades', 'max_drawdown', 'max_used_bp', 'sharpe', 'ulcer', 'cagr']:
+            assert pd.isna(row[col]) and pd.isna(actual[k][col]) or abs(row[col] - actual[k][col]) <= 1e-6 * max(1, abs(row[col])), (k, col)
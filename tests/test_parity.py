@@ -0,0 +1,49 @@
+'''
+The array engines give the same trades as run.backtest_df, on bench.synthetic data (see strategies/parity.py).
+'''
+import pandas as pd
+import pytest
+
+from bench import synthetic
+from strategies.parity import mismatches, parity
+from strategies.vectorized import backtest_vectorized, DAILY
+from strategies.hourly import backtest_hourly
+from strategies.momopump import SimplePump, SimplePumpDaily_Fibo
+
+
+DAILY_GRID = {'sl_prc': [0.1, 0.3], 'reward': [1, 3], 'fibo': [0, 3], 'pullback': [0.6], 'rvol': [3], 'day_net_change': [0.2]}
+HOURLY_GRID = {'sl_prc': [0.1, 0.3], 'reward': [1, 3], 'entry_hour': [15, 4, 8], 'pullback': [0.6], 'rvol': [3], 'day_net_change': [0.2]}
+
+
+def first(grid: dict, strategy) -> dict:
+    return {k: v[0] for k, v in grid.items() if hasattr(strategy, k)}
+
+
+@pytest.mark.parametrize('strategy', DAILY, ids=lambda s: s.__name__)
+def test_daily_parity(strategy):
+    dfs = synthetic(3, 300, '1d', seed=1)
+    assert sum(len(backtest_vectorized(df, strategy, first(DAILY_GRID, strategy))) for df in dfs) > 0  # there are trades to compare
+    assert mismatches(dfs, strategy, DAILY_GRID, backtest_vectorized) == []
+
+def test_hourly_parity():
+    dfs = synthetic(3, 3200, '1h', seed=1)
+    assert sum(len(backtest_hourly(df, SimplePump, first(HOURLY_GRID, SimplePump))) for df in dfs) > 0
+    assert mismatches(dfs, SimplePump, HOURLY_GRID, backtest_hourly) == []
+
+def test_parity_reports():
+    # an engine that's off comes back as rows, even on categoricals with other categories than the reference's
+    def engine(df, strategy, strategy_pars):
+        trades = backtest_vectorized(df, strategy, strategy_pars)
+        return trades.assign(exit_reason=pd.Categorical(['other'] * len(trades)))
+    df = synthetic(1, 300, '1d', seed=1)[0]
+    pars = first(DAILY_GRID, SimplePumpDaily_Fibo)
+    assert len(parity(df, SimplePumpDaily_Fibo, pars, engine)) == len(backtest_vectorized(df, SimplePumpDaily_Fibo, pars)) > 0
+
+@pytest.mark.parametrize('strategy', [s for s in DAILY if 'reward' in s.schema()], ids=lambda s: s.__name__)
+def test_fractional_reward(strategy):
+    # the reward tag is a float column: 1.5 isn't cut to 1
+    df = synthetic(1, 300, '1d', seed=1)[0]
+    pars = {**first(DAILY_GRID, strategy), 'reward': 1.5}
+    assert mismatches([df], strategy, {k: [v] for k, v in pars.items()}, backtest_vectorized) == []
+    trades = backtest_vectorized(df, strategy, pars)
+    assert len(trades) > 0 and (trades['reward'] == 1.5).all()
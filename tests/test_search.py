@@ -0,0 +1,25 @@
+'''
+search.py scores a combination like stats.csv does, on bench.synthetic data.
+'''
+import numpy as np
+import pandas as pd
+
+from bench import synthetic
+from search import score
+from stats.extender import FIXED_COLS, extend, f
+from stats import get_stats_batch
+from strategies.momopump import SimplePumpDaily_Fibo
+from strategies.vectorized import backtest_vectorized
+
+PARS = {'sl_prc': 0.1, 'reward': 2, 'fibo': 0, 'pullback': 0.6, 'rvol': 3, 'day_net_change': 0.2}
+
+
+def test_score():
+    raw = pd.concat([backtest_vectorized(df, SimplePumpDaily_Fibo, PARS) for df in synthetic(20, 1000, '1d', seed=2)], ignore_index=True)
+    # what the extender gives for the same pars: the backtest's thresholds let every trade through
+    grid = {'day_net_change': [f(0.2, '>=')], 'rvol': [f(3, '>=')], 'pullback': [f(0.6, '<=')]}
+    (edf,) = extend(raw.copy(), grid, FIXED_COLS, trade_on_open=True, trim_pnl='sl/tp')
+    assert len(edf['df']) == len(raw) > 0
+    expected = get_stats_batch(edf['df'].assign(**edf['pars']), list(edf['pars']))['score'].iloc[0]
+    assert np.isclose(score([raw], [PARS])[0], expected, rtol=1e-9)
+    assert not np.isclose(score([raw.drop(columns=['exit', 'exit_reason'])], [PARS])[0], expected, rtol=1e-9)  # the adjustments matter here
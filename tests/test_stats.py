@@ -0,0 +1,81 @@
+'''
+The vectorized and chunked stats give the same numbers as get_stats_df, on extended trades of bench.synthetic data,
+and the stats.py helpers the same as their row by row versions (stats/regression.py).
+'''
+import numpy as np
+import pandas as pd
+import pytest
+
+from bench import synthetic
+from stats import get_stats_df, get_stats_batch, get_stats_chunked, get_mc_stats, strip_pnl_series, STATS_COLUMNS
+from stats.stats import get_days, concat_days, get_mc_days
+from stats.extender import GRID, FIXED_COLS, extend
+from stats.regression import get_fixture, check
+from strategies.momopump import SimplePumpDaily_Fibo
+from strategies.vectorized import backtest_vectorized
+from utils import read_trades
+
+PARS = {'sl_prc': 0.1, 'reward': 2, 'fibo': 0, 'pullback': 0.6, 'rvol': 3, 'day_net_change': 0.2}
+MC = 50
+
+
+@pytest.fixture(scope='module')
+def edfs() -> list[dict]:
+    dfs = synthetic(20, 1000, '1d', seed=2)
+    raw = pd.concat([backtest_vectorized(df, SimplePumpDaily_Fibo, PARS) for df in dfs], ignore_index=True)
+    return [edf for edf in extend(raw, GRID, FIXED_COLS) if not edf['df'].empty]
+
+def assert_same(expected: dict, actual: dict, skip: str = None):
+    assert expected.keys() <= actual.keys()
+    for k, v in expected.items():
+        if skip and k.startswith(skip): continue
+        assert np.isclose(float(v), float(actual[k]), rtol=1e-9, atol=1e-9, equal_nan=True), (k, v, actual[k])
+
+
+def test_regression():
+    assert check([get_fixture(seed=seed) for seed in range(5)] + [get_fixture(n=1)])
+
+def test_batch(edfs):
+    assert len(edfs) > 10
+    pars = list(edfs[0]['pars'].keys())
+    batch = get_stats_batch(pd.concat([edf['df'][STATS_COLUMNS].assign(**edf['pars']) for edf in edfs], ignore_index=True), pars, MC)
+    assert batch.shape[0] == len(edfs)
+    assert list(get_stats_batch(batch.iloc[:0], pars, MC).columns) == list(batch.columns)  # no trades, same columns
+    for edf, (_, row) in zip(edfs, batch.iterrows()):
+        assert_same(get_stats_df(edf['df'][STATS_COLUMNS].copy(), edf['pars'], MC), row.to_dict())
+
+def test_chunked(edfs, tmp_path):
+    edf = max(edfs, key=lambda edf: edf['df'].shape[0])
+    path = tmp_path / 'trades-sl_prc=0.1-reward=2.0.csv'
+    edf['df'].to_csv(path, index=False)
+    expected = get_stats_df(read_trades(str(path), usecols=STATS_COLUMNS), {'sl_prc': 0.1, 'reward': 2.0}, MC)
+    assert_same(expected, get_stats_chunked(str(path), chunksize=7, mc=MC), skip='mc_')  # the mc resamples days there, see test_mc_days
+
+@pytest.mark.parametrize('seed', range(3))
+def test_chunked_fixture(seed, tmp_path):
+    # with its NaN PnLs and exits at the same time
+    path = tmp_path / 'trades-sl_prc=0.1-reward=2.0.csv'
+    get_fixture(seed=seed).to_csv(path, index=False)
+    expected = get_stats_df(read_trades(str(path), usecols=STATS_COLUMNS), {'sl_prc': 0.1, 'reward': 2.0}, MC)
+    assert_same(expected, get_stats_chunked(str(path), chunksize=97, mc=MC), skip='mc_')
+
+def test_mc_days(edfs):
+    # shuffled, the days give the drawdown, streak and cagr of the trades, and a day split between blocks is put back together
+    df = max(edfs, key=lambda edf: edf['df'].shape[0])['df'].sort_values('ExitTime', kind='stable')
+    pnl = strip_pnl_series(df['PnL'], 0.1, 2).values
+    net_pnl = pnl - df['Size'].values * 0.014
+    day = df['ExitTime'].values.astype('datetime64[D]')
+    days = get_days(pnl, net_pnl, day)
+    blocks = concat_days([get_days(pnl[i:i + 7], net_pnl[i:i + 7], day[i:i + 7]) for i in range(0, len(pnl), 7)])
+    for k, v in days.items():
+        np.testing.assert_allclose(v.astype(np.float64), blocks[k].astype(np.float64), rtol=1e-9, atol=1e-9, err_msg=k)
+    expected = get_mc_stats(pnl, net_pnl, day, 2.0, MC, 'shuffle')
+    actual = get_mc_days(days, 2.0, MC, 'shuffle')
+    assert_same({k: v for k, v in expected.items() if not k.startswith('mc_ulcer')}, actual)
+    assert np.isclose(expected['mc_ulcer_p50'], actual['mc_ulcer_p50'], rtol=0.5)
+
+def test_one_day():
+    # every exit on the same day: no cagr, the rest is still scored
+    df = get_fixture(n=50).assign(ExitTime=pd.Timestamp('2021-01-04'))
+    stats = get_stats_df(df, {'sl_prc': 0.1, 'reward': 2}, MC)
+    assert np.isnan(stats['cagr']) and stats['total_trades'] == 50
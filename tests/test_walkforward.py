@@ -0,0 +1,24 @@
+'''
+stats/walkforward.py over extended trades of bench.synthetic data, with a gap in them.
+'''
+import pandas as pd
+
+from bench import synthetic
+from stats.extender import GRID, FIXED_COLS, extend
+from stats.walkforward import walk_forward
+from stats import STATS_COLUMNS
+from strategies.momopump import SimplePumpDaily_Fibo
+from strategies.vectorized import backtest_vectorized
+
+PARS = {'sl_prc': 0.1, 'reward': 2, 'fibo': 0, 'pullback': 0.6, 'rvol': 3, 'day_net_change': 0.2}
+
+
+def test_gap():
+    raw = pd.concat([backtest_vectorized(df, SimplePumpDaily_Fibo, PARS) for df in synthetic(20, 1000, '1d', seed=2)], ignore_index=True)
+    edfs = [edf for edf in extend(raw, GRID, FIXED_COLS) if not edf['df'].empty]
+    df = pd.concat([edf['df'][STATS_COLUMNS].assign(**edf['pars']) for edf in edfs], ignore_index=True)
+    df = df[df['EntryTime'].dt.year != 2021]  # train windows with no trades at all
+    windows, oos = walk_forward(df, list(edfs[0]['pars'].keys()), min_trades=1, train=pd.DateOffset(months=6), test=pd.DateOffset(months=3))
+    in_gap = (windows['train_start'] >= '2021-01-01') & (windows['test_start'] <= '2022-01-01')
+    assert in_gap.any() and windows.loc[in_gap, 'sl_prc'].isna().all()  # nothing picked there
+    assert windows.loc[~in_gap, 'sl_prc'].notna().any() and not oos.empty
@@ -0,0 +1,337 @@
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+import json
+import os
+import shutil
+import uuid
+
+from utils import TRADE_COLUMNS, compact
+from profiling import timed
+
+
+PAR_PREFIX = 'par_'
+
+TRADE_DTYPES = {
+    'Symbol': 'string',
+    'Size': 'int64',
+    'EntryBar': 'int64',
+    'ExitBar': 'int64',
+    'EntryPrice': 'float64',
+    'ExitPrice': 'float64',
+    'SL': 'float64',
+    'TP': 'float64',
+    'PnL': 'float64',
+    'ReturnPct': 'float64',
+    'EntryTime': 'datetime64[ns]',
+    'ExitTime': 'datetime64[ns]',
+    'Duration': 'timedelta64[ns]',
+    'Tag': 'string',
+}
+
+
+def trades_filename(pars: dict) -> str:
+    return 'trades-' + '-'.join([k + '=' + str(v) for k, v in pars.items()]) + '.csv'
+
+
+def trim_partial_row(filepath: str):
+    # cuts whatever follows the last newline, i.e. half a row left by a crash in the middle of TradeWriter.checkpoint()
+    with open(filepath, 'r+b') as file:
+        size = file.seek(0, os.SEEK_END)
+        file.seek(max(0, size - 2**20))
+        tail = file.read()
+        cut = tail.rfind(b'\n')
+        if cut != len(tail) - 1:
+            file.truncate(size - len(tail) + cut + 1)
+
+
+class TradeWriter:
+
+    '''
+    Appends trades to their files as soon as they come back from the workers, instead of holding
+    a whole combination in memory. Files are written under {out_dir}.partial and only moved into out_dir
+    on finish()/close(), so an interrupted run never leaves a half-written trades-*.csv behind.
+    checkpoint() appends what's new of them to the files in out_dir, complete rows only.
+
+        with TradeWriter(out_dir) as writer:
+            writer.write({'sl_prc': 0.1, 'reward': 2}, df)
+    '''
+
+    def __init__(self, out_dir: str, columns: list[str] = TRADE_COLUMNS):
+        self.out_dir = out_dir
+        self.tmp_dir = out_dir.rstrip('/\\') + '.partial'
+        self.columns = columns
+        self.files = {}  # filename: bytes of it already in out_dir
+        os.makedirs(self.out_dir, exist_ok=True)
+        os.makedirs(self.tmp_dir, exist_ok=True)
+
+    def open(self, filename: str):
+        # carries on from the file already in out_dir (see run.run_grid / manifest.py, which drop() what's stale first),
+        # otherwise header only, so a combination without trades still gets its file
+        if filename in self.files: return
+        if os.path.exists(self.out_dir + '/' + filename):
+            trim_partial_row(self.out_dir + '/' + filename)
+            shutil.copyfile(self.out_dir + '/' + filename, self.tmp_dir + '/' + filename)
+            self.files[filename] = os.path.getsize(self.out_dir + '/' + filename)
+        else:
+            pd.DataFrame(columns=self.columns).to_csv(self.tmp_dir + '/' + filename, index=False)
+            self.files[filename] = 0
+
+    @timed('write')
+    def write(self, pars: dict, df: pd.DataFrame):
+        filename = trades_filename(pars)
+        self.open(filename)
+        if df.empty: return
+        df[self.columns].to_csv(self.tmp_dir + '/' + filename, mode='a', header=False, index=False)
+
+    def finish(self, pars: dict):
+        # the combination is complete, move its file into place
+        filename = trades_filename(pars)
+        self.open(filename)
+        os.replace(self.tmp_dir + '/' + filename, self.out_dir + '/' + filename)
+        del self.files[filename]
+
+    def checkpoint(self):
+        # everything written so far goes into out_dir and is on disk when this returns. Only the bytes written since
+        # the last checkpoint are copied, the files stay here and later writes carry on appending to them
+        for filename, synced in self.files.items():
+            with open(self.tmp_dir + '/' + filename, 'rb') as src, open(self.out_dir + '/' + filename, 'ab') as dst:
+                src.seek(synced)
+                shutil.copyfileobj(src, dst)
+                dst.flush()
+                os.fsync(dst.fileno())
+                self.files[filename] = src.tell()
+
+    def drop(self, pars: dict, symbols: list[str] = None):
+        # removes the combination's file, or only the trades of `symbols` from it (before any write to it)
+        filepath = self.out_dir + '/' + trades_filename(pars)
+        if not os.path.exists(filepath): return
+        if symbols is None:
+            os.remove(filepath)
+            return
+        trim_partial_row(filepath)
+        df = pd.read_csv(filepath, keep_default_na=False, dtype=str)  # rewritten as is
+        df[~df['Symbol'].isin(symbols)].to_csv(self.tmp_dir + '/' + trades_filename(pars), index=False)
+        os.replace(self.tmp_dir + '/' + trades_filename(pars), filepath)
+
+    def close(self):
+        for filename in list(self.files):
+            os.replace(self.tmp_dir + '/' + filename, self.out_dir + '/' + filename)
+        self.files.clear()
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def abort(self):
+        self.files.clear()
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+class TradeStore:
+
+    '''
+    One parquet dataset per stage (data/trades-{name}/raw.parquet, extended.parquet) instead of a CSV per combination.
+    Pars are real float64 columns named par_{name}, so they don't clash with the trade columns of the same name
+    (e.g. the pullback threshold vs the trade's actual pullback). The `partitioning` ones become hive directories
+    (par_sl_prc=0.1/par_reward=2.0/...), the rest are stored on the rows, so read() can filter by pars
+    (pruned by directory / row group stats) and load only the columns it needs.
+
+    Writes are buffered per combination and land as whole part files renamed into place, so an interrupted run
+    leaves no torn files. Same write/finish/close interface as TradeWriter.
+    '''
+
+    def __init__(self, path: str, partitioning: list[str] = None, buffer_rows: int = 1_000_000):
+        self.path = path.rstrip('/\\')
+        meta = self.path + '/_pars.json'
+        if os.path.exists(meta):
+            with open(meta) as file:
+                saved = json.load(file)
+            self.pars, self.partitioning = saved['pars'], saved['partitioning']
+        else:
+            self.pars, self.partitioning = None, partitioning or []
+        self.buffer_rows = buffer_rows
+        self.buffers: dict[tuple, list[pd.DataFrame]] = {}
+        self.buffered = 0
+
+    def _init_meta(self, pars: dict):
+        if self.pars is not None: return
+        self.pars = list(pars.keys())
+        os.makedirs(self.path, exist_ok=True)
+        tmp = f'{self.path}/_pars.{uuid.uuid4().hex}.json'  # several workers may write the same store
+        with open(tmp, 'w') as file:
+            json.dump({'pars': self.pars, 'partitioning': self.partitioning}, file)
+        os.replace(tmp, self.path + '/_pars.json')
+
+    @timed('write')
+    def write(self, pars: dict, df: pd.DataFrame):
+        self._init_meta(pars)
+        if df.empty: return
+        key = tuple(pars.items())
+        self.buffers.setdefault(key, []).append(df)
+        self.buffered += df.shape[0]
+        if self.buffered > self.buffer_rows:
+            self.flush()
+
+    def finish(self, pars: dict):
+        self._flush(tuple(pars.items()))
+
+    def flush(self):
+        for key in list(self.buffers.keys()):
+            self._flush(key)
+
+    def _flush(self, key: tuple):
+        dfs = self.buffers.pop(key, [])
+        if not dfs: return
+        pars = dict(key)
+        df = pd.concat(dfs, ignore_index=True)
+        self.buffered -= df.shape[0]
+        for col, dtype in TRADE_DTYPES.items():
+            if col not in df.columns: continue
+            df[col] = df[col].astype(str) if dtype == 'string' else df[col].astype(dtype)
+        for col in df.columns[[isinstance(dtype, pd.CategoricalDtype) for dtype in df.dtypes]]:
+            df[col] = df[col].astype(str)  # stored as text whatever it is in memory (see utils.compact), so every part file has the same schema
+        for k, v in pars.items():
+            if k not in self.partitioning:
+                df[PAR_PREFIX + k] = float(v)
+        dirpath = '/'.join([self.path, *[f'{PAR_PREFIX}{k}={float(pars[k])}' for k in self.partitioning]])
+        os.makedirs(dirpath, exist_ok=True)
+        name = uuid.uuid4().hex
+        pq.write_table(pa.Table.from_pandas(df, preserve_index=False), f'{dirpath}/.{name}.parquet')  # dotfiles are skipped by readers
+        os.replace(f'{dirpath}/.{name}.parquet', f'{dirpath}/{name}.parquet')
+
+    def checkpoint(self):
+        self.flush()
+
+    def drop(self, pars: dict, symbols: list[str] = None):
+        '''
+        Removes the combination's rows, or only the ones of `symbols`, rewriting the part files that hold them.
+        '''
+        if not self.exists(): return
+        dirpath = '/'.join([self.path, *[f'{PAR_PREFIX}{k}={float(pars[k])}' for k in self.partitioning]])
+        if not os.path.isdir(dirpath): return
+        expr = ds.scalar(True)
+        for k, v in pars.items():
+            if k not in self.partitioning:
+                expr = expr & (ds.field(PAR_PREFIX + k) == float(v))
+        if symbols is not None:
+            expr = expr & ds.field('Symbol').isin(symbols)
+        for name in os.listdir(dirpath):
+            if name.startswith(('.', '_')) or not name.endswith('.parquet'): continue
+            table = pq.read_table(f'{dirpath}/{name}')
+            kept = table.filter(~expr)
+            if kept.num_rows == table.num_rows: continue
+            if kept.num_rows == 0:
+                os.remove(f'{dirpath}/{name}')
+                continue
+            pq.write_table(kept, f'{dirpath}/.{name}')
+            os.replace(f'{dirpath}/.{name}', f'{dirpath}/{name}')
+
+    def close(self):
+        self.flush()
+
+    def abort(self):
+        self.buffers.clear()
+        self.buffered = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def dataset(self) -> ds.Dataset:
+        partitioning = ds.partitioning(pa.schema([(PAR_PREFIX + k, pa.float64()) for k in self.partitioning]), flavor='hive')
+        return ds.dataset(self.path, format='parquet', partitioning=partitioning)
+
+    def read(self, columns: list[str] = None, filter: dict | ds.Expression = None) -> pd.DataFrame:
+        '''
+        filter - {par: value} (equality) or a pyarrow expression, e.g. ds.field('par_rvol') >= 5
+        returns the trades in the compact dtypes (utils.compact)
+        '''
+        if isinstance(filter, dict):
+            expr = None
+            for k, v in filter.items():
+                cond = ds.field(PAR_PREFIX + k) == float(v)
+                expr = cond if expr is None else expr & cond
+            filter = expr
+        return compact(self.dataset().to_table(columns=columns, filter=filter).to_pandas())
+
+    def exists(self) -> bool:
+        return self.pars is not None and os.path.exists(self.path)
+
+    def partitions(self) -> list[dict]:
+        # straight from the directory names, no data is read
+        parts = [ds.get_partition_keys(fragment.partition_expression) for fragment in self.dataset().get_fragments()]
+        return [dict(t) for t in dict.fromkeys(tuple((k, p[PAR_PREFIX + k]) for k in self.partitioning) for p in parts)]
+
+    def combinations(self) -> list[dict]:
+        df = self.read(columns=[PAR_PREFIX + k for k in self.pars]).drop_duplicates()
+        return df.rename(columns=lambda c: c[len(PAR_PREFIX):]).to_dict('records')
+
+
+MEMORY_BUDGET = 32 * 2**30
+
+
+def count_lines(filepath: str) -> int:
+    with open(filepath, 'rb') as file:
+        return sum(block.count(b'\n') for block in iter(lambda: file.read(2**24), b''))
+
+def memory_budget(path: str, budget: int = MEMORY_BUDGET, sample_rows: int = 100_000) -> dict:
+    '''
+    Would all the trades of a stage (a dir of trades-*.csv or a TradeStore) fit in `budget` bytes of RAM,
+    as read_csv gives them and in the compact dtypes (utils.compact)? The rows are counted (csv lines, parquet metadata),
+    the bytes per row are measured on a sample of them.
+    '''
+    store = TradeStore(path)
+    if store.exists():
+        rows = store.dataset().count_rows()
+        read = store.dataset().head(sample_rows).to_pandas()
+        compacted = compact(read)
+    else:
+        fnames = [fname for fname in os.listdir(path) if fname.endswith('.csv')]
+        rows = sum(count_lines(f'{path}/{fname}') - 1 for fname in fnames)
+        read = []
+        for fname in fnames:
+            if sum(map(len, read)) >= sample_rows: break
+            df = pd.read_csv(f'{path}/{fname}', nrows=sample_rows)
+            if not df.empty: read.append(df)
+        read = pd.concat(read, ignore_index=True) if read else pd.DataFrame()
+        compacted = compact(read)
+    per_row = lambda df: df.memory_usage(index=False, deep=True).sum() / df.shape[0] if df.shape[0] else 0.0
+
+    report = {
+        'rows': rows,
+        'read_bytes_per_row': per_row(read),
+        'compact_bytes_per_row': per_row(compacted),
+        'budget': budget,
+    }
+    report['read_bytes'] = report['rows'] * report['read_bytes_per_row']
+    report['compact_bytes'] = report['rows'] * report['compact_bytes_per_row']
+    report['fits'] = report['compact_bytes'] <= budget
+    report['columns'] = {col: {'read': str(read[col].dtype), 'compact': str(compacted[col].dtype), 'bytes_per_row': compacted[col].memory_usage(index=False, deep=True) / compacted.shape[0]}
+                         for col in compacted.columns if col in read.columns}
+
+    gb = lambda x: f'{x / 2**30:,.2f}GB'
+    print(f'{rows:,} trades in {path}')
+    for col, c in report['columns'].items():
+        print(f'{col:>16} {c["read"]:>16} -> {c["compact"]:<16} {c["bytes_per_row"]:6.1f} B/row')
+    print(f'read: {report["read_bytes_per_row"]:.0f} B/row, {gb(report["read_bytes"])}; compact: {report["compact_bytes_per_row"]:.0f} B/row, {gb(report["compact_bytes"])}')
+    print(f'{"fits" if report["fits"] else "does NOT fit"} in {gb(budget)}' + ('' if report['fits'] else f', {budget / report["compact_bytes_per_row"]:,.0f} rows would'))
+    return report
+
+
+if __name__ == '__main__':
+    import sys
+    # python trades.py data/trades-{name}/raw [budget GB]
+    memory_budget(sys.argv[1], int(float(sys.argv[2]) * 2**30) if len(sys.argv) > 2 else MEMORY_BUDGET)
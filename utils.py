@@ -3,6 +3,18 @@ from datetime import datetime
 import pandas as pd
 
 
+TRADE_COLUMNS = ['Symbol', 'Size', 'EntryBar', 'ExitBar', 'EntryPrice', 'ExitPrice', 'SL', 'TP', 'PnL', 'ReturnPct', 'EntryTime', 'ExitTime', 'Duration']  # + the strategy's schema() columns
+
+# trades in memory: categorical symbols, 32 bit sizes and bar numbers, float32 only for ReturnPct (nothing computes with it).
+# Prices, PnL and the tag values the extender filters on stay float64
+COMPACT_DTYPES = {'Symbol': 'category', 'Size': 'int32', 'EntryBar': 'int32', 'ExitBar': 'int32', 'ReturnPct': 'float32'}
+
+# trade files bigger than STREAM_ABOVE bytes aren't loaded whole, they're read CHUNK_ROWS trades at a time
+# (stats.get_stats, extender.extend_file), so a worker's memory doesn't grow with the file
+STREAM_ABOVE = 2 * 1024**3
+CHUNK_ROWS = 500_000
+
+
 def split_into_symbol_batches(symbols: list[dict], batch_size: int = 2000):
     batches = [symbols[i : i + batch_size] for i in range(0, len(symbols), batch_size)]
     return [[record['symbol'] for record in batch] for batch in batches]
@@ -21,3 +33,41 @@ def load_by_stats(stats: dict, dirpath: str, pars: list[str] = ['day_net_change'
     df['ExitTime'] = pd.to_datetime(df['ExitTime'])
     df = df.sort_values('ExitTime')
     return df
+
+def compact(df: pd.DataFrame) -> pd.DataFrame:
+    '''
+    A trades frame (any subset of the columns) in COMPACT_DTYPES, times parsed (read_csv leaves them as text)
+    and the text tags (e.g. exit_reason) categorical. Ints that don't fit 32 bits are left as they are.
+    An empty frame is left as it is (read from a header-only csv its columns are all text).
+    '''
+    if df.empty: return df
+    dtypes = {}
+    for col, dtype in COMPACT_DTYPES.items():
+        if col not in df.columns or df[col].dtype == dtype: continue
+        if dtype == 'int32' and not (df[col].min() >= -2**31 and df[col].max() < 2**31): continue
+        dtypes[col] = dtype
+    for col in df.columns:
+        if col not in COMPACT_DTYPES and col != 'Tag' and (df[col].dtype == object or pd.api.types.is_string_dtype(df[col])):
+            dtypes[col] = 'category'
+    for col in ['EntryTime', 'ExitTime']:
+        if col in dtypes: dtypes[col] = 'datetime64[ns]'
+    if 'Duration' in dtypes:
+        df = df.assign(Duration=pd.to_timedelta(df['Duration']))
+        del dtypes['Duration']
+    return df.astype(dtypes) if dtypes else df
+
+def read_csv_args(filepath: str, usecols: list[str] = None) -> dict:
+    # a trades csv straight into the compact dtypes, without the object columns in between where read_csv can
+    head = pd.read_csv(filepath, nrows=0).columns
+    dtypes = {col: dtype for col, dtype in COMPACT_DTYPES.items() if col in head and (usecols is None or col in usecols) and dtype != 'int32'}
+    times = [col for col in ['EntryTime', 'ExitTime'] if col in head and (usecols is None or col in usecols)]
+    return {'usecols': usecols, 'dtype': dtypes, 'parse_dates': times}
+
+def read_trades(filepath: str, usecols: list[str] = None) -> pd.DataFrame:
+    return compact(pd.read_csv(filepath, **read_csv_args(filepath, usecols)))
+
+def read_trades_chunks(filepath: str, usecols: list[str] = None, chunksize: int = CHUNK_ROWS):
+    # read_trades, chunksize rows at a time. Every chunk is compacted on its own and indexed from 0
+    with pd.read_csv(filepath, chunksize=chunksize, **read_csv_args(filepath, usecols)) as reader:
+        for chunk in reader:
+            yield compact(chunk.reset_index(drop=True))